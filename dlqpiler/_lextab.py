@@ -0,0 +1,10 @@
+# _lextab.py. This file automatically created by PLY (version 3.11). Don't edit!
+_tabversion   = '3.10'
+_lextokens    = set(('AMPLIFY', 'AND', 'ASSIGN', 'COMMA', 'DIVIDE', 'EQUAL', 'FALSE', 'GT', 'HAT', 'ID', 'IN', 'LBRACKET', 'LCURLY', 'LPAREN', 'LT', 'MINUS', 'MUL', 'NEQ', 'NOT', 'NUMBER', 'OR', 'PLUS', 'RBRACKET', 'RCURLY', 'RPAREN', 'SEMICOLON', 'TIMES', 'TRUE'))
+_lexreflags   = 64
+_lexliterals  = ''
+_lexstateinfo = {'INITIAL': 'inclusive'}
+_lexstatere   = {'INITIAL': [('(?P<t_NUMBER>\\d+)|(?P<t_ID>[a-zA-Z_][a-zA-Z_0-9]*)|(?P<t_newline>\\n+)|(?P<t_PLUS>\\+)|(?P<t_MUL>\\*)|(?P<t_HAT>\\^)|(?P<t_NEQ>!=)|(?P<t_ASSIGN>:=)|(?P<t_LPAREN>\\()|(?P<t_RPAREN>\\))|(?P<t_LCURLY>\\{)|(?P<t_RCURLY>\\})|(?P<t_LBRACKET>\\[)|(?P<t_RBRACKET>\\])|(?P<t_MINUS>-)|(?P<t_DIVIDE>/)|(?P<t_EQUAL>=)|(?P<t_LT><)|(?P<t_GT>>)|(?P<t_COMMA>,)|(?P<t_SEMICOLON>;)', [None, ('t_NUMBER', 'NUMBER'), ('t_ID', 'ID'), ('t_newline', 'newline'), (None, 'PLUS'), (None, 'MUL'), (None, 'HAT'), (None, 'NEQ'), (None, 'ASSIGN'), (None, 'LPAREN'), (None, 'RPAREN'), (None, 'LCURLY'), (None, 'RCURLY'), (None, 'LBRACKET'), (None, 'RBRACKET'), (None, 'MINUS'), (None, 'DIVIDE'), (None, 'EQUAL'), (None, 'LT'), (None, 'GT'), (None, 'COMMA'), (None, 'SEMICOLON')])]}
+_lexstateignore = {'INITIAL': ' \t'}
+_lexstateerrorf = {'INITIAL': 't_error'}
+_lexstateeoff = {}
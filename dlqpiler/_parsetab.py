@@ -0,0 +1,58 @@
+
+# _parsetab.py
+# This file is automatically generated. Do not edit.
+# pylint: disable=W,C,R
+_tabversion = '3.10'
+
+_lr_method = 'LALR'
+
+_lr_signature = 'leftORleftANDrightNOTleftLTGTleftEQUALNEQleftPLUSMINUSleftMULDIVIDErightUMINUSrightHATAMPLIFY AND ASSIGN COMMA DIVIDE EQUAL FALSE GT HAT ID IN LBRACKET LCURLY LPAREN LT MINUS MUL NEQ NOT NUMBER OR PLUS RBRACKET RCURLY RPAREN SEMICOLON TIMES TRUEfullcode : regdefseq amplifytermamplifyterm : AMPLIFY ID NUMBER TIMESregdefseq : regdefseq regdef SEMICOLONregdefseq : regdef SEMICOLONregdef : regdefs\n              | regdefxregdefs : ID LBRACKET NUMBER RBRACKET IN LCURLY expseq RCURLYregdefx : ID LBRACKET NUMBER RBRACKET ASSIGN expressionexpseq : expseq COMMA expressionexpseq : expressionexpression : expression OR expressionexpression : expression AND expressionexpression : NOT expressionexpression : expression EQUAL expression\n                  | expression NEQ expression\n                  | expression LT expression\n                  | expression GT expression\n                  | expression PLUS expression\n                  | expression MINUS expression\n                  | expression MUL expressionexpression : expression HAT expressionexpression : expression DIVIDE expressionexpression : MINUS expression %prec UMINUSexpression : LPAREN expression RPARENexpression : FALSEexpression : TRUEexpression : NUMBERexpression : ID'
+    
+_lr_action_items = {'ID':([0,2,9,10,12,19,20,24,25,26,31,32,33,34,35,36,37,38,39,40,41,46,],[6,6,13,-4,-3,21,21,21,21,21,21,21,21,21,21,21,21,21,21,21,21,21,]),'$end':([1,7,17,],[0,-1,-2,]),'AMPLIFY':([2,10,12,],[9,-4,-3,]),'SEMICOLON':([3,4,5,8,21,22,23,27,28,42,43,45,47,48,49,50,51,52,53,54,55,56,57,58,],[10,-5,-6,12,-28,-27,-8,-25,-26,-13,-23,-7,-11,-12,-14,-15,-16,-17,-18,-19,-20,-21,-22,-24,]),'LBRACKET':([6,],[11,]),'NUMBER':([11,13,19,20,24,25,26,31,32,33,34,35,36,37,38,39,40,41,46,],[14,15,22,22,22,22,22,22,22,22,22,22,22,22,22,22,22,22,22,]),'RBRACKET':([14,],[16,]),'TIMES':([15,],[17,]),'IN':([16,],[18,]),'ASSIGN':([16,],[19,]),'LCURLY':([18,],[20,]),'NOT':([19,20,24,25,26,31,32,33,34,35,36,37,38,39,40,41,46,],[24,24,24,24,24,24,24,24,24,24,24,24,24,24,24,24,24,]),'MINUS':([19,20,21,22,23,24,25,26,27,28,30,31,32,33,34,35,36,37,38,39,40,41,42,43,44,46,47,48,49,50,51,52,53,54,55,56,57,58,59,],[25,25,-28,-27,38,25,25,25,-25,-26,38,25,25,25,25,25,25,25,25,25,25,25,38,-23,38,25,38,38,38,38,38,38,-18,-19,-20,-21,-22,-24,38,]),'LPAREN':([19,20,24,25,26,31,32,33,34,35,36,37,38,39,40,41,46,],[26,26,26,26,26,26,26,26,26,26,26,26,26,26,26,26,26,]),'FALSE':([19,20,24,25,26,31,32,33,34,35,36,37,38,39,40,41,46,],[27,27,27,27,27,27,27,27,27,27,27,27,27,27,27,27,27,]),'TRUE':([19,20,24,25,26,31,32,33,34,35,36,37,38,39,40,41,46,],[28,28,28,28,28,28,28,28,28,28,28,28,28,28,28,28,28,]),'OR':([21,22,23,27,28,30,42,43,44,47,48,49,50,51,52,53,54,55,56,57,58,59,],[-28,-27,31,-25,-26,31,-13,-23,31,-11,-12,-14,-15,-16,-17,-18,-19,-20,-21,-22,-24,31,]),'AND':([21,22,23,27,28,30,42,43,44,47,48,49,50,51,52,53,54,55,56,57,58,59,],[-28,-27,32,-25,-26,32,-13,-23,32,32,-12,-14,-15,-16,-17,-18,-19,-20,-21,-22,-24,32,]),'EQUAL':([21,22,23,27,28,30,42,43,44,47,48,49,50,51,52,53,54,55,56,57,58,59,],[-28,-27,33,-25,-26,33,33,-23,33,33,33,-14,-15,33,33,-18,-19,-20,-21,-22,-24,33,]),'NEQ':([21,22,23,27,28,30,42,43,44,47,48,49,50,51,52,53,54,55,56,57,58,59,],[-28,-27,34,-25,-26,34,34,-23,34,34,34,-14,-15,34,34,-18,-19,-20,-21,-22,-24,34,]),'LT':([21,22,23,27,28,30,42,43,44,47,48,49,50,51,52,53,54,55,56,57,58,59,],[-28,-27,35,-25,-26,35,35,-23,35,35,35,-14,-15,-16,-17,-18,-19,-20,-21,-22,-24,35,]),'GT':([21,22,23,27,28,30,42,43,44,47,48,49,50,51,52,53,54,55,56,57,58,59,],[-28,-27,36,-25,-26,36,36,-23,36,36,36,-14,-15,-16,-17,-18,-19,-20,-21,-22,-24,36,]),'PLUS':([21,22,23,27,28,30,42,43,44,47,48,49,50,51,52,53,54,55,56,57,58,59,],[-28,-27,37,-25,-26,37,37,-23,37,37,37,37,37,37,37,-18,-19,-20,-21,-22,-24,37,]),'MUL':([21,22,23,27,28,30,42,43,44,47,48,49,50,51,52,53,54,55,56,57,58,59,],[-28,-27,39,-25,-26,39,39,-23,39,39,39,39,39,39,39,39,39,-20,-21,-22,-24,39,]),'HAT':([21,22,23,27,28,30,42,43,44,47,48,49,50,51,52,53,54,55,56,57,58,59,],[-28,-27,40,-25,-26,40,40,40,40,40,40,40,40,40,40,40,40,40,40,40,-24,40,]),'DIVIDE':([21,22,23,27,28,30,42,43,44,47,48,49,50,51,52,53,54,55,56,57,58,59,],[-28,-27,41,-25,-26,41,41,-23,41,41,41,41,41,41,41,41,41,-20,-21,-22,-24,41,]),'RCURLY':([21,22,27,28,29,30,42,43,47,48,49,50,51,52,53,54,55,56,57,58,59,],[-28,-27,-25,-26,45,-10,-13,-23,-11,-12,-14,-15,-16,-17,-18,-19,-20,-21,-22,-24,-9,]),'COMMA':([21,22,27,28,29,30,42,43,47,48,49,50,51,52,53,54,55,56,57,58,59,],[-28,-27,-25,-26,46,-10,-13,-23,-11,-12,-14,-15,-16,-17,-18,-19,-20,-21,-22,-24,-9,]),'RPAREN':([21,22,27,28,42,43,44,47,48,49,50,51,52,53,54,55,56,57,58,],[-28,-27,-25,-26,-13,-23,58,-11,-12,-14,-15,-16,-17,-18,-19,-20,-21,-22,-24,]),}
+
+_lr_action = {}
+for _k, _v in _lr_action_items.items():
+   for _x,_y in zip(_v[0],_v[1]):
+      if not _x in _lr_action:  _lr_action[_x] = {}
+      _lr_action[_x][_k] = _y
+del _lr_action_items
+
+_lr_goto_items = {'fullcode':([0,],[1,]),'regdefseq':([0,],[2,]),'regdef':([0,2,],[3,8,]),'regdefs':([0,2,],[4,4,]),'regdefx':([0,2,],[5,5,]),'amplifyterm':([2,],[7,]),'expression':([19,20,24,25,26,31,32,33,34,35,36,37,38,39,40,41,46,],[23,30,42,43,44,47,48,49,50,51,52,53,54,55,56,57,59,]),'expseq':([20,],[29,]),}
+
+_lr_goto = {}
+for _k, _v in _lr_goto_items.items():
+   for _x, _y in zip(_v[0], _v[1]):
+       if not _x in _lr_goto: _lr_goto[_x] = {}
+       _lr_goto[_x][_k] = _y
+del _lr_goto_items
+_lr_productions = [
+  ("S' -> fullcode","S'",1,None,None,None),
+  ('fullcode -> regdefseq amplifyterm','fullcode',2,'p_full_code','parser.py',36),
+  ('amplifyterm -> AMPLIFY ID NUMBER TIMES','amplifyterm',4,'p_amplify_terminator','parser.py',41),
+  ('regdefseq -> regdefseq regdef SEMICOLON','regdefseq',3,'p_regdef_sequence_body','parser.py',53),
+  ('regdefseq -> regdef SEMICOLON','regdefseq',2,'p_regdef_sequence_tail','parser.py',58),
+  ('regdef -> regdefs','regdef',1,'p_register_definition','parser.py',63),
+  ('regdef -> regdefx','regdef',1,'p_register_definition','parser.py',64),
+  ('regdefs -> ID LBRACKET NUMBER RBRACKET IN LCURLY expseq RCURLY','regdefs',8,'p_register_definition_set','parser.py',70),
+  ('regdefx -> ID LBRACKET NUMBER RBRACKET ASSIGN expression','regdefx',6,'p_register_definition_expression','parser.py',83),
+  ('expseq -> expseq COMMA expression','expseq',3,'p_expression_sequence_fork','parser.py',100),
+  ('expseq -> expression','expseq',1,'p_expression_sequence_tail','parser.py',107),
+  ('expression -> expression OR expression','expression',3,'p_expression_or','parser.py',116),
+  ('expression -> expression AND expression','expression',3,'p_expression_and','parser.py',130),
+  ('expression -> NOT expression','expression',2,'p_expression_not','parser.py',144),
+  ('expression -> expression EQUAL expression','expression',3,'p_expression_binary','parser.py',168),
+  ('expression -> expression NEQ expression','expression',3,'p_expression_binary','parser.py',169),
+  ('expression -> expression LT expression','expression',3,'p_expression_binary','parser.py',170),
+  ('expression -> expression GT expression','expression',3,'p_expression_binary','parser.py',171),
+  ('expression -> expression PLUS expression','expression',3,'p_expression_binary','parser.py',172),
+  ('expression -> expression MINUS expression','expression',3,'p_expression_binary','parser.py',173),
+  ('expression -> expression MUL expression','expression',3,'p_expression_binary','parser.py',174),
+  ('expression -> expression HAT expression','expression',3,'p_expression_power','parser.py',186),
+  ('expression -> expression DIVIDE expression','expression',3,'p_expression_division','parser.py',199),
+  ('expression -> MINUS expression','expression',2,'p_expression_uminus','parser.py',207),
+  ('expression -> LPAREN expression RPAREN','expression',3,'p_expression_parentheses','parser.py',218),
+  ('expression -> FALSE','expression',1,'p_expression_false','parser.py',224),
+  ('expression -> TRUE','expression',1,'p_expression_true','parser.py',228),
+  ('expression -> NUMBER','expression',1,'p_expression_number','parser.py',232),
+  ('expression -> ID','expression',1,'p_expression_id','parser.py',236),
+]
@@ -1,25 +1,150 @@
 #Filipe Chagas, 2023
 
 from typing import *
-from enum import Enum
-from typing import Set
-from dlqpiler import utils, qunits
+import weakref
+import array
+import io
+import json
+from enum import IntEnum
+from dlqpiler import qunits
+from dlqpiler.errors import SynthError
 import qiskit
-import math
+from qiskit.circuit.library import MCXGate, MCXVChain
 
-n_bits_const = lambda c: int(math.ceil(math.log2(c))) if c > 0 else 0
+#If True, the merge methods fold the constant operands of sums and products into a single operand, and drop the identity operations (x+0, x*1, x^1, --x)
+CONST_FOLD = True
 
-class SynthError(Exception):
-    def __init__(self, line: int, description: str) -> None:
-        self.line = line
-        self.description = description
-        super().__init__(f'Synthesis error at line {line}: {description}')
+def n_bits_const(c: int) -> int:
+    """Return ceil(log2(c)) for a positive integer c, or 0 otherwise. Computed exactly with integer operations.
+
+    :param c: Constant
+    :type c: int
+    :return: Number of bits
+    :rtype: int
+    """
+    return (c - 1).bit_length() if c > 0 else 0
 
-class Signal(Enum):
+class Signal():
+    #Signals are stored as plain booleans, so checking one is a truth test instead of an Enum comparison
     POS = True #Positive signal
     NEG = False #Negative signal
 
+class RelMode(IntEnum):
+    #Kinds of operands of a relational expression, set by pre_build
+    RR = 0 #register and register
+    RC = 1 #register and constant
+    CR = 2 #constant and register
+
+#to_dict representation of a signal, indexed by the signal itself (False -> '-', True -> '+')
+SIGNAL_STR = ('-', '+')
+
+def to_dict_value(value: object) -> object:
+    """Convert an attribute of an AST node to its to_dict representation
+
+    :param value: AST node, constant or list of these
+    :type value: object
+    :return: Tree of dictionaries or the value itself
+    :rtype: object
+    """
+    if isinstance(value, ASTNode):
+        return value.to_dict()
+    elif isinstance(value, (list, tuple)):
+        return [to_dict_value(v) for v in value]
+    elif isinstance(value, array.array):
+        return value.tolist()
+    else:
+        return value
+
+def write_json_value(value: object, out: TextIO):
+    """Write the JSON representation of an attribute of an AST node, without building its to_dict tree
+
+    :param value: AST node, constant or list of these
+    :type value: object
+    :param out: Output text stream
+    :type out: TextIO
+    """
+    if isinstance(value, ASTNode):
+        value.write_json(out)
+    elif isinstance(value, (list, tuple, array.array)):
+        out.write('[')
+        for i, v in enumerate(value):
+            if i > 0:
+                out.write(', ')
+            write_json_value(v, out)
+        out.write(']')
+    else:
+        out.write(json.dumps(value))
+
+def merge_operands(cls: type, left: object, right: object) -> tuple:
+    """Concatenate the operands of a binary operation into the operand tuple of a n-ary node.
+    Operands that already are cls nodes are flattened. Only one tuple is allocated in the common cases.
+
+    :param cls: Class of the n-ary node
+    :type cls: type
+    :param left: Left operand
+    :type left: object
+    :param right: Right operand
+    :type right: object
+    :return: Tuple of operands
+    :rtype: tuple
+    """
+    if type(left) is cls:
+        return tuple(left.operands) + tuple(right.operands) if type(right) is cls else tuple(left.operands) + (right,)
+    return (left,) + tuple(right.operands) if type(right) is cls else (left, right)
+
+def extend_operands(node: object, right: object) -> object:
+    """Append the right operand of a binary operation to the operand list of a n-ary node, in place.
+    Used by the parser to flatten left-associative chains with one amortized append per operator. It is only valid while the node is referenced by the operation being reduced.
+
+    :param node: N-ary node, left operand of the operation
+    :type node: object
+    :param right: Right operand
+    :type right: object
+    :return: The node
+    :rtype: object
+    """
+    assert node._leafs is None and node._structural_key is None and node._pre_built_for is None and node._dict_cache is None and node._n_result_qubits_cache is None, 'The node is already referenced elsewhere'
+    if type(right) is type(node):
+        node.operands.extend(right.operands)
+    else:
+        node.operands.append(Parentheses.bypass(right))
+    return node
+
+def insert_operand(node: object, operand: object, signal: Optional[bool] = None) -> object:
+    """Add an expression operand to the operand list of a Summation or Product node, in place.
+    With constant folding, the folded constant stays the last operand, so the new operand is inserted before it. The result is the same as merging the node with the operand, without copying the operand list.
+    Used by the parser to flatten left-associative chains. It is only valid while the node is referenced by the operation being reduced.
+
+    :param node: Summation or Product node, left operand of the operation
+    :type node: object
+    :param operand: Expression operand, that is not a node of the same kind
+    :type operand: object
+    :param signal: Signal of the operand if node is a Summation, defaults to None
+    :type signal: Optional[bool], optional
+    :return: The node
+    :rtype: object
+    """
+    assert node._leafs is None and node._structural_key is None and node._pre_built_for is None and node._dict_cache is None and node._n_result_qubits_cache is None, 'The node is already referenced elsewhere'
+    operands = node.operands
+    i = len(operands) - 1 if CONST_FOLD and len(operands) > 0 and isinstance(operands[-1], int) else len(operands)
+    operands.insert(i, operand)
+    if signal is not None:
+        node.signals.insert(i, signal)
+    return node
+
+#The concrete AST node classes are never subclassed outside this module, so hot paths test them with exact type checks (type(x) is Cls) instead of isinstance
 class ASTNode():
+    __slots__ = ('line', '_dict_cache')
+    #Pairs (key, attribute) that to_dict serializes, in order, after the 'type' key
+    _dict_fields: Tuple[Tuple[str, str], ...] = ()
+    #Value of the 'type' key in to_dict
+    _TYPE_NAME: str = 'ASTNode'
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        if '_TYPE_NAME' not in cls.__dict__:
+            cls._TYPE_NAME = cls.__name__
+
     def __init__(self, line: int) -> None:
         """
         :param line: Line of code
@@ -27,30 +152,106 @@ class ASTNode():
         """
         assert isinstance(line, int)
         self.line = line
+        self._dict_cache = None
 
     def to_dict(self) -> Dict[str, object]:
         """
-        Recursively convert the AST to a tree of dictionaries
+        Recursively convert the AST to a tree of dictionaries.
+        The tree is memoized on the nodes, so it must be treated as read-only.
+
+        :return: Tree of dictionaries
+        :rtype: Dict[str, object]
+        """
+        if self._dict_cache is None:
+            self._dict_cache = self.make_dict()
+        return self._dict_cache
+
+    def make_dict(self) -> Dict[str, object]:
+        """
+        Build the dictionary of this node, without memoization
 
         :return: Tree of dictionaries
         :rtype: Dict[str, object]
         """
-        return dict()
+        d = {'type': self._TYPE_NAME}
+        for key, value in self.dict_items():
+            d[key] = to_dict_value(value)
+        return d
+
+    def dict_items(self) -> Iterator[Tuple[str, object]]:
+        """Iterate over the serialized (key, value) pairs of this node, after the 'type' key
+
+        :return: Iterator of (key, raw attribute value) pairs
+        :rtype: Iterator[Tuple[str, object]]
+        """
+        for key, attr in self._dict_fields:
+            yield key, getattr(self, attr)
+
+    def write_json(self, out: TextIO):
+        """Recursively write the AST as JSON, equivalent to json.dumps(self.to_dict()), without building the intermediate dictionaries
+
+        :param out: Output text stream
+        :type out: TextIO
+        """
+        out.write('{"type": ')
+        out.write(json.dumps(self._TYPE_NAME))
+        for key, value in self.dict_items():
+            out.write(', ')
+            out.write(json.dumps(key))
+            out.write(': ')
+            write_json_value(value, out)
+        out.write('}')
+
+    def to_json(self) -> str:
+        """
+        :return: JSON representation of the AST
+        :rtype: str
+        """
+        out = io.StringIO()
+        self.write_json(out)
+        return out.getvalue()
+
+    def clear_dict_cache(self):
+        """Recursively discard the memoized to_dict trees. Must be called after the AST is rewritten.
+        """
+        self._dict_cache = None
+        for key, attr in self._dict_fields:
+            value = getattr(self, attr)
+            for child in (value if isinstance(value, (list, tuple)) else [value]):
+                if isinstance(child, ASTNode):
+                    child.clear_dict_cache()
 
 # --- Expression AST nodes ---
 
 class Expression(ASTNode):
+    __slots__ = ('result', '_n_result_qubits_cache', '_structural_key', '_pre_built_for', '_leafs')
+    exclusive_operands = True #If True, an operand never shares the result of a previous sibling
+
     def __init__(self, line: int) -> None:
         super().__init__(line)
         self.result = None
+        self._n_result_qubits_cache = None #(quantum_evaluator, n) pair
+        self._structural_key = None
+        self._pre_built_for = None #Quantum evaluator of the last pre_build
+        self._leafs = None
+
+    def get_leafs(self) -> FrozenSet[str]:
+        """Return a set with all identifiers used in the expression, memoized since the operands of a node never change
+
+        :return: self-descriptive
+        :rtype: FrozenSet[str]
+        """
+        if self._leafs is None:
+            self._leafs = frozenset(self.iter_leafs())
+        return self._leafs
 
-    def get_leafs(self) -> Set[str]:
-        """Return a set with all identifiers used in the expression
+    def iter_leafs(self) -> Iterator[str]:
+        """Yield the identifiers used in the expression. An identifier used more than once is yielded more than once.
 
         :return: self-descriptive
-        :rtype: Set[str]
+        :rtype: Iterator[str]
         """
-        return set()
+        yield from ()
     
     def needs_result_allocation(self) -> bool:
         """
@@ -60,6 +261,21 @@ class Expression(ASTNode):
         return True
 
     def n_result_qubits(self, quantum_evaluator) -> int:
+        """Return the number of result qubits, memoized per quantum evaluator so each subtree is counted once per compilation
+
+        :param quantum_evaluator: Parent quantum evaluator
+        :type quantum_evaluator: QuantumEvaluator
+        :return: Number of necessary result qubits
+        :rtype: int
+        """
+        cache = self._n_result_qubits_cache
+        if cache is not None and cache[0] is quantum_evaluator:
+            return cache[1]
+        n = self.compute_n_result_qubits(quantum_evaluator)
+        self._n_result_qubits_cache = (quantum_evaluator, n)
+        return n
+
+    def compute_n_result_qubits(self, quantum_evaluator) -> int:
         """
         :param quantum_evaluator: Parent quantum evaluator
         :type quantum_evaluator: QuantumEvaluator
@@ -75,8 +291,8 @@ class Expression(ASTNode):
         :param quantum_evaluator: Parent quantum evaluator
         :type quantum_evaluator: QuantumEvaluator
         """
-        assert utils.is_none(self.result)
-        self.result = [quantum_evaluator.alloc_ancilla() for i in range(self.n_result_qubits(quantum_evaluator))]
+        assert self.result is None
+        self.result = quantum_evaluator.alloc_ancillas(self.n_result_qubits(quantum_evaluator))
 
     def release_result_qubits(self, quantum_evaluator):
         """Release the clean result qubits
@@ -84,21 +300,38 @@ class Expression(ASTNode):
         :param quantum_evaluator: Parent quantum evaluator
         :type quantum_evaluator: QuantumEvaluator
         """
-        assert not utils.is_none(self.result)
-        for qb in self.result:
-            quantum_evaluator.free_ancilla(qb)
+        assert self.result is not None
+        quantum_evaluator.free_ancillas(self.result)
         self.result = None
 
     def pre_build(self, quantum_evaluator):
-        """Do the necessary actions before the build operation
+        """Do the necessary actions before the build operation. Runs once per quantum evaluator, even if the node is reached more than once.
+
+        :param quantum_evaluator: Parent quantum evaluator
+        :type quantum_evaluator: QuantumEvaluator
+        """
+        if self._pre_built_for is quantum_evaluator:
+            return
+        self._pre_built_for = quantum_evaluator
+        self.prepare(quantum_evaluator)
+
+    def prepare(self, quantum_evaluator):
+        """Node-specific part of pre_build
 
         :param quantum_evaluator: Parent quantum evaluator
         :type quantum_evaluator: QuantumEvaluator
         """
         pass
     
-    def build(self, quantum_evaluator):
-        """Build the quantum circuit recursively
+    def operands_to_build(self) -> Sequence['Expression']:
+        """
+        :return: Expression operands that must be built before this node is emitted, in build order
+        :rtype: Sequence[Expression]
+        """
+        return ()
+
+    def emit(self, quantum_evaluator):
+        """Append the gates of this node to the quantum circuit. The operands are already built.
 
         :param quantum_evaluator: Parent quantum evaluator
         :type quantum_evaluator: QuantumEvaluator
@@ -106,8 +339,8 @@ class Expression(ASTNode):
         """
         raise NotImplementedError()
 
-    def reverse(self, quantum_evaluator):
-        """Build the inverse quantum circuit recursively
+    def emit_inverse(self, quantum_evaluator):
+        """Append the inverse gates of this node to the quantum circuit. The operands are still built.
 
         :param quantum_evaluator: Parent quantum evaluator
         :type quantum_evaluator: QuantumEvaluator
@@ -115,7 +348,266 @@ class Expression(ASTNode):
         """
         raise NotImplementedError()
 
+    def trace(self) -> Tuple[Tuple[bool, 'Expression', Sequence['Expression'], int], ...]:
+        """Lower the expression tree into a flat program, so build and reverse run as a loop over a precomputed sequence instead of walking the tree.
+        Each node has an enter instruction before its operands and an exit instruction after them. The enter instruction holds the position after the matching exit, so a shared subtree can be skipped.
+
+        :return: Sequence of (enter, node, siblings, end) instructions
+        :rtype: Tuple[Tuple[bool, Expression, Sequence[Expression], int], ...]
+        """
+        program = []
+        stack = [(self, (), -1)] #(node, siblings, position of the enter instruction or -1 if the node was not entered yet)
+        while stack:
+            node, siblings, enter_pos = stack.pop()
+            if enter_pos >= 0:
+                program.append((False, node, (), 0))
+                program[enter_pos] = (True, node, siblings, len(program))
+                continue
+            stack.append((node, siblings, len(program)))
+            program.append(None) #Filled when the node exits
+            operands = node.operands_to_build()
+            exclusive = node.exclusive_operands
+            for i in range(len(operands) - 1, -1, -1):
+                stack.append((operands[i], operands[:i] if exclusive else (), -1))
+        return tuple(program)
+
+    def count_ancillas(self, quantum_evaluator, program: Sequence[Tuple[bool, 'Expression', Sequence['Expression'], int]], live_results: Dict[Hashable, list], owners: Dict['Expression', 'Expression'], n_live: int = 0) -> Tuple[int, int]:
+        """Run a lifetime analysis of the ancillas that build uses, without building it. The sharing decisions are the same as in build.
+        The result qubits of the operands stay allocated until reverse, while the ancillas borrowed by each emit are released right after it.
+
+        :param quantum_evaluator: Parent quantum evaluator
+        :type quantum_evaluator: QuantumEvaluator
+        :param program: Program returned by trace
+        :type program: Sequence[Tuple[bool, Expression, Sequence[Expression], int]]
+        :param live_results: Structural key -> [node that builds the shared result, number of users]. Updated like QuantumEvaluator.live_results, so it can be passed through the expressions built one after another.
+        :type live_results: Dict[Hashable, list]
+        :param owners: Node -> node that builds its result. Filled for the nodes that allocate result qubits, and used by count_reverse_ancillas.
+        :type owners: Dict[Expression, Expression]
+        :param n_live: Number of ancillas already in use when the build starts, defaults to 0
+        :type n_live: int, optional
+        :return: Number of result qubits allocated by the build and peak number of ancillas in use during the build
+        :rtype: Tuple[int, int]
+        """
+        n = 0
+        peak = n_live
+        pc = 0
+        while pc < len(program):
+            enter, node, siblings, end = program[pc]
+            pc += 1
+            if not enter:
+                peak = max(peak, n_live + n + node.n_borrowed_ancillas(quantum_evaluator))
+            if node is self or not node.needs_result_allocation():
+                continue
+            key = node.structural_key()
+            if not enter:
+                if key is not None and key not in live_results:
+                    live_results[key] = [node, 1]
+                continue
+            entry = live_results.get(key) if key is not None else None
+            if entry is not None and all(owners.get(sibling) is not entry[0] for sibling in siblings):
+                entry[1] += 1
+                owners[node] = entry[0]
+                pc = end
+            else:
+                owners[node] = node
+                n += node.n_result_qubits(quantum_evaluator)
+        return n, max(peak, n_live + n)
+
+    def count_reverse_ancillas(self, quantum_evaluator, program: Sequence[Tuple[bool, 'Expression', Sequence['Expression'], int]], live_results: Dict[Hashable, list], owners: Dict['Expression', 'Expression'], n_live: int) -> Tuple[int, int]:
+        """Counterpart of count_ancillas for reverse. The result qubits are released while reverse runs, but the operands are uncomputed while the results of their siblings are still allocated, so reverse can need more ancillas than build.
+
+        :param quantum_evaluator: Parent quantum evaluator
+        :type quantum_evaluator: QuantumEvaluator
+        :param program: Program returned by trace
+        :type program: Sequence[Tuple[bool, Expression, Sequence[Expression], int]]
+        :param live_results: Shared results left by count_ancillas, updated like QuantumEvaluator.live_results
+        :type live_results: Dict[Hashable, list]
+        :param owners: Node -> node that builds its result, filled by count_ancillas
+        :type owners: Dict[Expression, Expression]
+        :param n_live: Number of ancillas in use when the reverse starts
+        :type n_live: int
+        :return: Number of ancillas still in use after the reverse and peak number of ancillas in use during the reverse
+        :rtype: Tuple[int, int]
+        """
+        peak = n_live
+        pc = 0
+        while pc < len(program):
+            enter, node, siblings, end = program[pc]
+            pc += 1
+            if node is self:
+                if enter:
+                    peak = max(peak, n_live + node.n_borrowed_ancillas(quantum_evaluator))
+                continue
+            if not enter:
+                if node.needs_result_allocation():
+                    n_live -= node.n_result_qubits(quantum_evaluator)
+                continue
+            #Same decisions as unshare_result
+            key = node.structural_key() if node.needs_result_allocation() else None
+            entry = live_results.get(key) if key is not None else None
+            builder = node
+            if entry is not None and owners.get(node) is entry[0]:
+                entry[1] -= 1
+                builder = None
+                if entry[1] == 0:
+                    del live_results[key]
+                    builder = entry[0]
+            if builder is node:
+                peak = max(peak, n_live + node.n_borrowed_ancillas(quantum_evaluator))
+                continue
+            pc = end
+            if builder is not None:
+                n_live, builder_peak = builder.count_reverse_ancillas(quantum_evaluator, builder.trace(), live_results, owners, n_live)
+                peak = max(peak, builder_peak)
+                n_live -= builder.n_result_qubits(quantum_evaluator)
+        return n_live, peak
+
+    def n_borrowed_ancillas(self, quantum_evaluator) -> int:
+        """
+        :param quantum_evaluator: Parent quantum evaluator
+        :type quantum_evaluator: QuantumEvaluator
+        :return: Number of clean ancillas that emit and emit_inverse borrow from the pool around their gates
+        :rtype: int
+        """
+        return 0
+
+    def build(self, quantum_evaluator, program: Sequence[Tuple[bool, 'Expression', Sequence['Expression'], int]] = None):
+        """Build the quantum circuit of the expression tree by running its traced program.
+        The result qubits of this node must be already assigned. The operands allocate their own result qubits.
+
+        :param quantum_evaluator: Parent quantum evaluator
+        :type quantum_evaluator: QuantumEvaluator
+        :param program: Program returned by trace, defaults to None (trace now)
+        :type program: Sequence[Tuple[bool, Expression, Sequence[Expression], int]], optional
+        """
+        if program is None:
+            program = self.trace()
+        pc = 0
+        while pc < len(program):
+            enter, node, siblings, end = program[pc]
+            pc += 1
+            if not enter:
+                node.emit(quantum_evaluator)
+                if node is not self:
+                    node.register_result(quantum_evaluator)
+            elif node is not self:
+                if node.share_result(quantum_evaluator, siblings):
+                    pc = end
+                elif node.needs_result_allocation():
+                    node.alloc_result_qubits(quantum_evaluator)
+
+    def reverse(self, quantum_evaluator, program: Sequence[Tuple[bool, 'Expression', Sequence['Expression'], int]] = None):
+        """Build the inverse quantum circuit of the expression tree by running its traced program, mirroring build
+
+        :param quantum_evaluator: Parent quantum evaluator
+        :type quantum_evaluator: QuantumEvaluator
+        :param program: Program returned by trace, defaults to None (trace now)
+        :type program: Sequence[Tuple[bool, Expression, Sequence[Expression], int]], optional
+        """
+        if program is None:
+            program = self.trace()
+        pc = 0
+        while pc < len(program):
+            enter, node, siblings, end = program[pc]
+            pc += 1
+            if node is self:
+                if enter:
+                    node.emit_inverse(quantum_evaluator)
+            elif not enter:
+                if node.needs_result_allocation():
+                    node.release_result_qubits(quantum_evaluator)
+            else:
+                builder = node.unshare_result(quantum_evaluator)
+                if builder is node:
+                    node.emit_inverse(quantum_evaluator)
+                else:
+                    pc = end #The operands of a shared node were never built
+                    if builder is not None: #Last user of a result built by another node
+                        builder.reverse(quantum_evaluator)
+                        builder.release_result_qubits(quantum_evaluator)
+
+    def structural_key(self) -> Hashable:
+        """Return a hashable key that is equal for structurally identical expressions (after pre_build), or None if the expression can not be shared
+
+        :return: Structural key
+        :rtype: Hashable
+        """
+        if self._structural_key is None:
+            self._structural_key = self.compute_structural_key()
+        return self._structural_key
+
+    def compute_structural_key(self) -> Hashable:
+        """
+        :return: Structural key, or None if the expression can not be shared
+        :rtype: Hashable
+        """
+        return None
+
+    def share_result(self, quantum_evaluator, siblings: Sequence['Expression']) -> bool:
+        """If a structurally identical expression is already built and alive, take its result qubits instead of building this expression again (common subexpression elimination).
+
+        :param quantum_evaluator: Parent quantum evaluator
+        :type quantum_evaluator: QuantumEvaluator
+        :param siblings: Operands of the same parent node that are already built. Their results are never shared with this operand, so a gate never receives the same qubit twice.
+        :type siblings: Sequence[Expression]
+        :return: True if the result was shared
+        :rtype: bool
+        """
+        key = self.structural_key() if self.needs_result_allocation() else None
+        if key is None:
+            return False
+        entry = quantum_evaluator.live_results.get(key)
+        if entry is None or any(entry[0].result is sibling.result for sibling in siblings):
+            return False
+        entry[1] += 1
+        self.result = entry[0].result
+        return True
+
+    def register_result(self, quantum_evaluator):
+        """Make the result of this freshly built operand available to structurally identical expressions
+
+        :param quantum_evaluator: Parent quantum evaluator
+        :type quantum_evaluator: QuantumEvaluator
+        """
+        key = self.structural_key() if self.needs_result_allocation() else None
+        if key is not None and key not in quantum_evaluator.live_results:
+            quantum_evaluator.live_results[key] = [self, 1]
+
+    def unshare_result(self, quantum_evaluator) -> Optional['Expression']:
+        """Inverse of share_result and register_result. A shared result is uncomputed and released by the node that built it, when its last user reverses it.
+
+        :param quantum_evaluator: Parent quantum evaluator
+        :type quantum_evaluator: QuantumEvaluator
+        :return: Node that must be uncomputed now, or None if the result is still used by other nodes
+        :rtype: Optional[Expression]
+        """
+        key = self.structural_key() if self.needs_result_allocation() else None
+        entry = quantum_evaluator.live_results.get(key) if key is not None else None
+        if entry is None or entry[0].result is not self.result:
+            return self
+        builder = entry[0]
+        if builder is not self:
+            self.result = None
+        entry[1] -= 1
+        if entry[1] > 0:
+            return None
+        del quantum_evaluator.live_results[key]
+        return builder
+
+def operand_key(operand: Union[Expression, int]) -> Hashable:
+    """
+    :param operand: Expression or constant operand
+    :type operand: Union[Expression, int]
+    :return: Structural key of the operand. Constants are their own key.
+    :rtype: Hashable
+    """
+    return operand if isinstance(operand, int) else operand.structural_key()
+
 class Identifier(Expression):
+    __slots__ = ('label', '__weakref__')
+    _dict_fields = (('label', 'label'),)
+    _interned = weakref.WeakValueDictionary() #(label, line) -> Identifier
+
     def __init__(self, line: int, label: str) -> None:
         """
         :param line: Line of code
@@ -127,28 +619,56 @@ class Identifier(Expression):
         assert isinstance(label, str)
         self.label = label
 
-    def get_leafs(self) -> Set[str]:
-        return {self.label}
+    @classmethod
+    def intern(cls, line: int, label: str) -> object:
+        """Return a shared Identifier object for the given label and line, creating it on first use.
+        The line is part of the key so that error messages keep pointing to the right line.
 
-    def n_result_qubits(self, quantum_evaluator) -> int:
+        :param line: Line of code
+        :type line: int
+        :param label: Text of the identifier
+        :type label: str
+        :return: Identifier object
+        :rtype: Identifier
+        """
+        key = (label, line)
+        node = cls._interned.get(key)
+        if node is None:
+            node = cls(line, label)
+            cls._interned[key] = node
+        return node
+
+    def iter_leafs(self) -> Iterator[str]:
+        yield self.label
+
+    def compute_n_result_qubits(self, quantum_evaluator) -> int:
         n = quantum_evaluator.get_register_size(self.label)
-        if utils.is_none(n):
+        if n is None:
             raise SynthError(self.line, f'Identifier "{self.label}" not defined')
         return n
     
     def needs_result_allocation(self) -> bool:
         return False
 
-    def to_dict(self) -> Dict[str, object]:
-        return {'type': 'Identifier', 'label': self.label}
+    def compute_structural_key(self) -> Hashable:
+        return ('Identifier', self.label)
 
-    def pre_build(self, quantum_evaluator):
-        qreg = quantum_evaluator.get_qiskit_register(self.label)
-        if utils.is_none(qreg):
+    def emit(self, quantum_evaluator):
+        pass #The result is the register itself, bound in pre_build
+
+    def emit_inverse(self, quantum_evaluator):
+        pass
+
+    def prepare(self, quantum_evaluator):
+        qubits = quantum_evaluator.get_qubit_list(self.label)
+        if qubits is None:
             raise SynthError(self.line, f'Identifier "{self.label}" not defined')
-        self.result = [qubit for qubit in qreg]
+        self.result = qubits
 
 class Parentheses(Expression):
+    __slots__ = ('inner_expr',)
+    _dict_fields = (('inner_expr', 'inner_expr'),)
+
     def __init__(self, line: int, inner_expr: Expression) -> None:
         """
         :param line: Line of code
@@ -160,21 +680,21 @@ class Parentheses(Expression):
         assert isinstance(inner_expr, Expression)
         self.inner_expr = inner_expr
 
-    def get_leafs(self) -> Set[str]:
-        return self.inner_expr.get_leafs()
+    def iter_leafs(self) -> Iterator[str]:
+        yield from self.inner_expr.iter_leafs()
 
-    def pre_build(self, quantum_evaluator):
+    def prepare(self, quantum_evaluator):
         self.inner_expr.pre_build(quantum_evaluator)
 
-    def n_result_qubits(self, quantum_evaluator) -> int:
+    def compute_n_result_qubits(self, quantum_evaluator) -> int:
         return self.inner_expr.n_result_qubits(quantum_evaluator)
 
+    def compute_structural_key(self) -> Hashable:
+        return self.inner_expr.structural_key()
+
     def needs_result_allocation(self) -> bool:
         return False
     
-    def to_dict(self) -> Dict[str, object]:
-        return {'type': 'Parentheses', 'inner_expr': self.inner_expr.to_dict()}
-
     @staticmethod
     def bypass(expr: Expression) -> Expression:
         """If expr is a Parentheses node or a chain of multiple Parentheses nodes, it returns the first inner not-Parentheses expression.
@@ -185,13 +705,15 @@ class Parentheses(Expression):
         :rtype: Expression
         """
         x = expr
-        while isinstance(x, Parentheses):
+        while type(x) is Parentheses:
             x = x.inner_expr
         return x
     
 # --- Arithmetic expression AST nodes ---
 
 class ArithmeticExpression(Expression):
+    __slots__ = ()
+
     def __init__(self, line: int) -> None:
         """
         :param line: Line of code
@@ -200,6 +722,9 @@ class ArithmeticExpression(Expression):
         super().__init__(line)
 
 class UnaryMinus(ArithmeticExpression):
+    __slots__ = ('inner_expr',)
+    _dict_fields = (('inner_expr', 'inner_expr'),)
+
     def __init__(self, line: int, inner_expr: Expression) -> None:
         """
         :param line: Line of code
@@ -211,19 +736,35 @@ class UnaryMinus(ArithmeticExpression):
         assert isinstance(inner_expr, Expression)
         self.inner_expr = inner_expr
 
+    @staticmethod
+    def merge(line: int, inner_expr: Expression) -> Expression:
+        """Return a UnaryMinus object to an operand
+
+        :param line: Line of code
+        :type line: int
+        :param inner_expr: Operand
+        :type inner_expr: Expression
+        :return: UnaryMinus object, or the operand of a double negation
+        :rtype: Expression
+        """
+        assert isinstance(inner_expr, Expression)
+        if CONST_FOLD and type(inner_expr) is UnaryMinus:
+            return inner_expr.inner_expr
+        return UnaryMinus(line, inner_expr)
+
     def needs_result_allocation(self) -> bool:
         return False
 
-    def pre_build(self, quantum_evaluator):
+    def prepare(self, quantum_evaluator):
         self.inner_expr.pre_build(quantum_evaluator)
     
-    def get_leafs(self) -> Set[str]:
-        return self.inner_expr.get_leafs()
+    def iter_leafs(self) -> Iterator[str]:
+        yield from self.inner_expr.iter_leafs()
 
-    def to_dict(self) -> Dict[str, object]:
-        return {'type': 'UnaryMinus', 'inner_expr': self.inner_expr.to_dict()}
-    
 class Power(ArithmeticExpression):
+    __slots__ = ('base_expr', 'exponent')
+    _dict_fields = (('base_expr', 'base_expr'), ('exponent', 'exponent'))
+
     def __init__(self, line: int, base_expr: Expression, exponent: int) -> None:
         """
         :param line: Line of code
@@ -236,57 +777,110 @@ class Power(ArithmeticExpression):
         super().__init__(line)
         assert isinstance(base_expr, Expression)
         assert isinstance(exponent, int)
-        self.base_expr = base_expr
+        self.base_expr = Parentheses.bypass(base_expr)
         self.exponent = exponent
 
-    def get_leafs(self) -> Set[str]:
-        return self.base_expr.get_leafs()
+    @staticmethod
+    def merge(line: int, base_expr: Expression, exponent: int) -> Union[Expression, int]:
+        """Return a Power object to a base and a constant exponent
 
-    def to_dict(self) -> Dict[str, object]:
-        return {'type': 'Power', 'base_expr': self.base_expr.to_dict(), 'exponent': self.exponent}
-    
-    def n_result_qubits(self, quantum_evaluator) -> int:
+        :param line: Line of code
+        :type line: int
+        :param base_expr: Base
+        :type base_expr: Expression
+        :param exponent: Exponent
+        :type exponent: int
+        :return: Power object, or the base or constant that the power folds to
+        :rtype: Union[Power, Expression, int]
+        """
+        assert isinstance(base_expr, Expression)
+        assert isinstance(exponent, int)
+        if CONST_FOLD:
+            if exponent == 0:
+                return 1
+            if exponent == 1:
+                return base_expr
+        return Power(line, base_expr, exponent)
+
+    def iter_leafs(self) -> Iterator[str]:
+        yield from self.base_expr.iter_leafs()
+
+    def compute_n_result_qubits(self, quantum_evaluator) -> int:
         nb = self.base_expr.n_result_qubits(quantum_evaluator)
         return nb*self.exponent
     
-    def pre_build(self, quantum_evaluator):
+    def prepare(self, quantum_evaluator):
         self.base_expr.pre_build(quantum_evaluator)
-        self.base_expr = Parentheses.bypass(self.base_expr)
-        
-    def build(self, quantum_evaluator) -> List[qiskit.circuit.Qubit]:
-        if self.base_expr.needs_result_allocation():
-            self.base_expr.alloc_result_qubits(quantum_evaluator)
-        
-        if not isinstance(self.base_expr, Identifier):
-            self.base_expr.build(quantum_evaluator)
         
+    def compute_structural_key(self) -> Hashable:
+        base_key = self.base_expr.structural_key()
+        return None if base_key is None else ('Power', base_key, self.exponent)
+
+    def operands_to_build(self) -> Sequence[Expression]:
+        return (self.base_expr,)
+
+    def emit(self, quantum_evaluator):
         qunits.multiproduct(quantum_evaluator.quantum_circuit, [self.base_expr.result], [self.exponent], self.result)        
 
-    def reverse(self, quantum_evaluator) -> List[qiskit.circuit.Qubit]:
+    def emit_inverse(self, quantum_evaluator):
         qunits.multiproduct_dg(quantum_evaluator.quantum_circuit, [self.base_expr.result], [self.exponent], self.result)
 
-        if not isinstance(self.base_expr, Identifier):
-            self.base_expr.reverse(quantum_evaluator)
-
-        if self.base_expr.needs_result_allocation():
-            self.base_expr.release_result_qubits(quantum_evaluator)
+def strip_signal_wrappers(expr: Expression, signal: bool) -> Tuple[Expression, bool]:
+    """Strip a chain of Parentheses and UnaryMinus nodes in a single pass, flipping the signal once per UnaryMinus
+
+    :param expr: Summation operand
+    :type expr: Expression
+    :param signal: Signal of the operand
+    :type signal: bool
+    :return: Inner expression and its adjusted signal
+    :rtype: Tuple[Expression, bool]
+    """
+    while True:
+        if type(expr) is Parentheses:
+            expr = expr.inner_expr
+        elif type(expr) is UnaryMinus:
+            expr = expr.inner_expr
+            signal = not signal
+        else:
+            return expr, signal
+
+def strip_power_wrappers(expr: Expression) -> Tuple[Expression, int]:
+    """Strip a chain of Parentheses and Power nodes in a single pass, multiplying the exponents
+
+    :param expr: Product operand
+    :type expr: Expression
+    :return: Inner base expression and its total exponent
+    :rtype: Tuple[Expression, int]
+    """
+    exponent = 1
+    while True:
+        if type(expr) is Parentheses:
+            expr = expr.inner_expr
+        elif type(expr) is Power:
+            exponent *= expr.exponent
+            expr = expr.base_expr
+        else:
+            return expr, exponent
 
 class Product(ArithmeticExpression):
-    def __init__(self, line: int, operands: List[Union[Expression, int]]) -> None:
+    __slots__ = ('operands', 'const_factor', 'filtered_operands', 'filtered_exponents')
+    _dict_fields = (('operands', 'operands'),)
+
+    def __init__(self, line: int, operands: Sequence[Union[Expression, int]]) -> None:
         """
         :param line: Line of code
         :type line: int
         :param operands: Operands of the productory
-        :type operands: List[Union[Expression, int]]
-        :param signals: List with the signals of the operands
-        :type signals: List[Signal]
+        :type operands: Sequence[Union[Expression, int]]
         """
         super().__init__(line)
-        assert isinstance(operands, list)
-        assert all([isinstance(op, (Expression, int)) for op in operands])
-        self.operands = operands
-        self.exponents = [1]*len(self.operands)
+        assert all(isinstance(op, (Expression, int)) for op in operands)
+        self.operands = list(operands) #A list, so the parser can extend it in place
+        #Constant operands are multiplied here once, so pre_build only walks the expression operands
         self.const_factor = 1
+        for op in self.operands:
+            if isinstance(op, int):
+                self.const_factor *= op
         self.filtered_operands = []
         self.filtered_exponents = []
 
@@ -300,84 +894,111 @@ class Product(ArithmeticExpression):
         :type left: Union[Expression, int]
         :param right: Right operand
         :type right: Union[Expression, int]
-        :return: Product object
-        :rtype: Product
+        :return: Product object, or the operand/constant that the product folds to
+        :rtype: Union[Product, Expression, int]
         """
         assert isinstance(left, (Expression, int))
         assert isinstance(right, (Expression, int))
-        left_operands_list = left.operands if isinstance(left, Product) else [left]
-        right_operands_list = [right]
-        return Product(line, left_operands_list + right_operands_list)
+        if CONST_FOLD:
+            if isinstance(left, int) and isinstance(right, int):
+                return left * right
+            if (isinstance(left, int) and left == 0) or (isinstance(right, int) and right == 0):
+                return 0
+            if isinstance(left, int) and left == 1:
+                return right
+            if isinstance(right, int) and right == 1:
+                return left
+        operands = merge_operands(Product, left, right)
+        if CONST_FOLD:
+            operands = Product.fold_constants(operands)
+        return Product(line, operands)
+
+    @staticmethod
+    def fold_constants(operands: Tuple[Union[Expression, int], ...]) -> Tuple[Union[Expression, int], ...]:
+        """Multiply the constant operands into a single one, placed after the expression operands. A constant 1 is dropped.
 
-    def get_leafs(self) -> Set[str]:
-        leafs = set()
+        :param operands: Operands of a product
+        :type operands: Tuple[Union[Expression, int], ...]
+        :return: Folded operands
+        :rtype: Tuple[Union[Expression, int], ...]
+        """
+        exprs = []
+        const = 1
+        n_consts = 0
+        for op in operands:
+            if isinstance(op, int):
+                const *= op
+                n_consts += 1
+            else:
+                exprs.append(op)
+        if n_consts == 0 or (n_consts == 1 and isinstance(operands[-1], int) and operands[-1] != 1): #Already folded
+            return operands
+        if const == 1 and len(exprs) > 0:
+            return tuple(exprs)
+        return tuple(exprs) + (const,)
+
+    def iter_leafs(self) -> Iterator[str]:
         for op in self.operands:
             if isinstance(op, Expression):
-                leafs = leafs.union(op.get_leafs())
-        return leafs
+                yield from op.iter_leafs()
     
-    def to_dict(self) -> Dict[str, object]:
-        return {
-            'type': 'Product',
-            'operands': [(op.to_dict() if isinstance(op, Expression) else op) for op in self.operands]
-        }
-    
-    def n_result_qubits(self, quantum_evaluator) -> int:
-        return sum([self.filtered_operands[i].n_result_qubits(quantum_evaluator)*self.filtered_exponents[i] for i in range(len(self.filtered_operands))]) + n_bits_const(self.const_factor)
+    def compute_n_result_qubits(self, quantum_evaluator) -> int:
+        return sum(op.n_result_qubits(quantum_evaluator)*exponent for op, exponent in zip(self.filtered_operands, self.filtered_exponents)) + n_bits_const(self.const_factor)
     
-    def pre_build(self, quantum_evaluator):
+    def prepare(self, quantum_evaluator):
+        self._n_result_qubits_cache = None #The filtered operands are rebuilt below
+        self._structural_key = None
+        self.filtered_operands = []
+        self.filtered_exponents = []
         #--- merge power operations ---
-        for i in range(len(self.operands)):
-            if isinstance(self.operands[i], int):
-                self.const_factor *= self.operands[i]
-            else:
-                self.operands[i].pre_build(quantum_evaluator)
-                while isinstance(self.operands[i], (Power, Parentheses)):
-                    self.operands[i] = Parentheses.bypass(self.operands[i])
-                    if isinstance(self.operands[i], Power):
-                        self.exponents[i] *= self.operands[i].exponent
-                        self.operands[i] = self.operands[i].base_expr
-                self.filtered_operands.append(self.operands[i])
-                self.filtered_exponents.append(self.exponents[i])
-
-    def build(self, quantum_evaluator):
-        for op in self.filtered_operands:
-            if op.needs_result_allocation():
-                op.alloc_result_qubits(quantum_evaluator)
-            
-            if not isinstance(op, Identifier):
-                op.build(quantum_evaluator)
-
+        for op in self.operands:
+            if isinstance(op, int):
+                continue
+            op.pre_build(quantum_evaluator)
+            op, exponent = strip_power_wrappers(op)
+            self.filtered_operands.append(op)
+            self.filtered_exponents.append(exponent)
+
+    def compute_structural_key(self) -> Hashable:
+        keys = tuple(op.structural_key() for op in self.filtered_operands)
+        if None in keys:
+            return None
+        return ('Product', keys, tuple(self.filtered_exponents), self.const_factor)
+
+    def operands_to_build(self) -> Sequence[Expression]:
+        return self.filtered_operands
+
+    def emit(self, quantum_evaluator):
         qunits.multiproduct(quantum_evaluator.quantum_circuit, [op.result for op in self.filtered_operands], self.filtered_exponents, self.result, self.const_factor)
 
-    def reverse(self, quantum_evaluator):
+    def emit_inverse(self, quantum_evaluator):
         qunits.multiproduct_dg(quantum_evaluator.quantum_circuit, [op.result for op in self.filtered_operands], self.filtered_exponents, self.result, self.const_factor)
 
-        for op in self.filtered_operands[::-1]:
-            if not isinstance(op, Identifier):
-                op.reverse()
-
-            if op.needs_result_allocation():
-                op.release_result_qubits(quantum_evaluator)
-
 class Summation(ArithmeticExpression):
-    def __init__(self, line: int, operands: List[Union[Expression, int]], signals: List[Signal]) -> None:
+    __slots__ = ('operands', 'signals', 'const_term', 'filtered_operands', 'filtered_signals')
+    _dict_fields = (('operands', 'operands'),)
+    exclusive_operands = False #The operands are only added to the result, so they can share qubits
+
+    def __init__(self, line: int, operands: Sequence[Union[Expression, int]], signals: Sequence[bool]) -> None:
         """
         :param line: Line of code
         :type line: int
         :param operands: Operands of the summation
-        :type operands: List[Union[Expression, int]]
-        :param signals: List with the signals of the operands
-        :type signals: List[Signal]
+        :type operands: Sequence[Union[Expression, int]]
+        :param signals: Signals of the operands
+        :type signals: Sequence[bool]
         """
         super().__init__(line)
-        assert isinstance(operands, list)
-        assert isinstance(signals, list)
-        assert all([isinstance(op, (Expression, int)) for op in operands])
-        assert all([isinstance(sig, Signal) for sig in signals])
-        self.operands = operands
-        self.signals = signals
+        assert len(operands) == len(signals)
+        assert all(isinstance(op, (Expression, int)) for op in operands)
+        assert all(isinstance(sig, bool) for sig in signals)
+        self.operands = list(operands) #Lists, so the parser can extend them in place
+        self.signals = list(signals)
+        #Constant operands are added here once, so pre_build only walks the expression operands
         self.const_term = 0
+        for op, sig in zip(self.operands, self.signals):
+            if isinstance(op, int):
+                self.const_term += op if sig else -op
         self.filtered_operands = []
         self.filtered_signals = []
 
@@ -391,16 +1012,25 @@ class Summation(ArithmeticExpression):
         :type left: Union[Expression, int]
         :param right: Right operand
         :type right: Union[Expression, int]
-        :return: Summation object
-        :rtype: Summation
+        :return: Summation object, or the operand/constant that the summation folds to
+        :rtype: Union[Summation, Expression, int]
         """
         assert isinstance(left, (Expression, int))
         assert isinstance(right, (Expression, int))
-        left_operands_list = left.operands if isinstance(left, Summation) else [left]
-        right_operands_list = [right]
-        left_signals_list = left.signals if isinstance(left, Summation) else [Signal.POS]
-        right_signals_list = [Signal.POS]
-        return Summation(line, left_operands_list + right_operands_list, left_signals_list + right_signals_list)
+        if CONST_FOLD:
+            if isinstance(left, int) and isinstance(right, int):
+                return left + right
+            if isinstance(left, int) and left == 0:
+                return right
+            if isinstance(right, int) and right == 0:
+                return left
+        left_signals = tuple(left.signals) if type(left) is Summation else (Signal.POS,)
+        right_signals = tuple(right.signals) if type(right) is Summation else (Signal.POS,)
+        operands = merge_operands(Summation, left, right)
+        signals = left_signals + right_signals
+        if CONST_FOLD:
+            operands, signals = Summation.fold_constants(operands, signals)
+        return Summation(line, operands, signals)
 
     @staticmethod
     def merge_sub(line: int, left: Union[Expression, int], right: Union[Expression, int]) -> object:
@@ -412,77 +1042,111 @@ class Summation(ArithmeticExpression):
         :type left: Union[Expression, int]
         :param right: Right operand
         :type right: Union[Expression, int]
-        :return: Summation object
-        :rtype: Summation
+        :return: Summation object, or the operand/constant that the subtraction folds to
+        :rtype: Union[Summation, Expression, int]
         """
         assert isinstance(left, (Expression, int))
         assert isinstance(right, (Expression, int))
-        left_operands_list = left.operands if isinstance(left, Summation) else [left]
-        right_operands_list = [right]
-        left_signals_list = left.signals if isinstance(left, Summation) else [Signal.POS]
-        right_signals_list = [Signal.NEG]
-        return Summation(line, left_operands_list + right_operands_list, left_signals_list + right_signals_list)
+        if CONST_FOLD:
+            if isinstance(left, int) and isinstance(right, int):
+                return left - right
+            if isinstance(right, int) and right == 0:
+                return left
+        left_signals = tuple(left.signals) if type(left) is Summation else (Signal.POS,)
+        #Subtracting a summation flips the signals of all its operands
+        right_signals = tuple(not sig for sig in right.signals) if type(right) is Summation else (Signal.NEG,)
+        operands = merge_operands(Summation, left, right)
+        signals = left_signals + right_signals
+        if CONST_FOLD:
+            operands, signals = Summation.fold_constants(operands, signals)
+        return Summation(line, operands, signals)
     
-    def get_leafs(self) -> Set[str]:
-        leafs = set()
+    @staticmethod
+    def fold_constants(operands: Tuple[Union[Expression, int], ...], signals: Tuple[bool, ...]) -> Tuple[Tuple[Union[Expression, int], ...], Tuple[bool, ...]]:
+        """Add the signed constant operands into a single one, placed after the expression operands. A constant 0 is dropped.
+
+        :param operands: Operands of a summation
+        :type operands: Tuple[Union[Expression, int], ...]
+        :param signals: Signals of the operands
+        :type signals: Tuple[bool, ...]
+        :return: Folded operands and signals
+        :rtype: Tuple[Tuple[Union[Expression, int], ...], Tuple[bool, ...]]
+        """
+        exprs, exprs_signals = [], []
+        const = 0
+        n_consts = 0
+        for op, sig in zip(operands, signals):
+            if isinstance(op, int):
+                const += op if sig else -op
+                n_consts += 1
+            else:
+                exprs.append(op)
+                exprs_signals.append(sig)
+        if n_consts == 0 or (n_consts == 1 and isinstance(operands[-1], int) and operands[-1] > 0): #Already folded
+            return operands, signals
+        if const == 0 and len(exprs) > 0:
+            return tuple(exprs), tuple(exprs_signals)
+        return tuple(exprs) + (abs(const),), tuple(exprs_signals) + (const >= 0,)
+
+    def iter_leafs(self) -> Iterator[str]:
         for op in self.operands:
             if isinstance(op, Expression):
-                leafs = leafs.union(op.get_leafs())
-        return leafs
+                yield from op.iter_leafs()
     
-    def to_dict(self) -> Dict[str, object]:
-        return {
-            'type': 'Summation',
-            'operands': [(op.to_dict() if isinstance(op, Expression) else op) for op in self.operands],
-            'signals': [('+' if sig == Signal.POS else '-') for sig in self.signals]
-        }
-    
-    def pre_build(self, quantum_evaluator):
-        for i in range(len(self.operands)):
-            if isinstance(self.operands[i], int):
-                self.const_term += self.operands[i] if self.signals[i] == Signal.POS else -self.operands[i]
-            else:
-                self.operands[i].pre_build(quantum_evaluator)
-                while isinstance(self.operands[i], (Parentheses, UnaryMinus)):
-                    self.operands[i] = Parentheses.bypass(self.operands[i])
-                    if isinstance(self.operands[i], UnaryMinus):
-                        self.operands[i] = self.operands[i].inner_expr
-                        self.signals[i] = Signal.POS if self.signals[i] == Signal.NEG else Signal.NEG
-                self.filtered_operands.append(self.operands[i])
-                self.filtered_signals.append(self.signals[i])
+    def dict_items(self) -> Iterator[Tuple[str, object]]:
+        yield from super().dict_items()
+        yield 'signals', [SIGNAL_STR[sig] for sig in self.signals]
 
-    def n_result_qubits(self, quantum_evaluator) -> int:
-        return max([op.n_result_qubits(quantum_evaluator)+1 for op in self.filtered_operands] + [n_bits_const(self.const_term)])
+    def prepare(self, quantum_evaluator):
+        self._n_result_qubits_cache = None #The filtered operands are rebuilt below
+        self._structural_key = None
+        self.filtered_operands = []
+        self.filtered_signals = []
+        for op, sig in zip(self.operands, self.signals):
+            if isinstance(op, int):
+                continue
+            op.pre_build(quantum_evaluator)
+            op, sig = strip_signal_wrappers(op, sig)
+            self.filtered_operands.append(op)
+            self.filtered_signals.append(sig)
+
+    def compute_n_result_qubits(self, quantum_evaluator) -> int:
+        n = n_bits_const(self.const_term)
+        for op in self.filtered_operands:
+            nop = op.n_result_qubits(quantum_evaluator) + 1
+            if nop > n:
+                n = nop
+        return n
 
-    def build(self, quantum_evaluator):
-        for i in range(len(self.filtered_operands)):
-            if self.filtered_operands[i].needs_result_allocation():
-                self.filtered_operands[i].alloc_result_qubits(quantum_evaluator)
+    def compute_structural_key(self) -> Hashable:
+        keys = tuple(op.structural_key() for op in self.filtered_operands)
+        if None in keys:
+            return None
+        return ('Summation', keys, tuple(self.filtered_signals), self.const_term)
 
-            if not isinstance(self.filtered_operands[i], Identifier):
-                self.filtered_operands[i].build(quantum_evaluator)
+    def operands_to_build(self) -> Sequence[Expression]:
+        return self.filtered_operands
 
-            if self.filtered_signals[i] == Signal.POS:
-                qunits.register_by_register_addition(quantum_evaluator.quantum_circuit, self.filtered_operands[i].result, self.result)
+    def emit(self, quantum_evaluator):
+        for op, sig in zip(self.filtered_operands, self.filtered_signals):
+            if sig:
+                qunits.register_by_register_addition(quantum_evaluator.quantum_circuit, op.result, self.result)
             else:
-                qunits.register_by_register_subtraction(quantum_evaluator.quantum_circuit, self.filtered_operands[i].result, self.result)
+                qunits.register_by_register_subtraction(quantum_evaluator.quantum_circuit, op.result, self.result)
         
-    def reverse(self, quantum_evaluator):
-        for i in range(len(self.filtered_operands)):
-            if self.filtered_signals[i] == Signal.POS:
-                qunits.register_by_register_addition_dg(quantum_evaluator.quantum_circuit, self.filtered_operands[i].result, self.result)
+    def emit_inverse(self, quantum_evaluator):
+        for op, sig in zip(self.filtered_operands[::-1], self.filtered_signals[::-1]):
+            if sig:
+                qunits.register_by_register_addition_dg(quantum_evaluator.quantum_circuit, op.result, self.result)
             else:
-                qunits.register_by_register_subtraction_dg(quantum_evaluator.quantum_circuit, self.filtered_operands[i].result, self.result)
-
-            if not isinstance(self.filtered_operands[i], Identifier):
-                self.filtered_operands[i].reverse(quantum_evaluator)
-
-            if self.filtered_operands[i].needs_result_allocation():
-                self.filtered_operands[i].release_result_qubits(quantum_evaluator)
+                qunits.register_by_register_subtraction_dg(quantum_evaluator.quantum_circuit, op.result, self.result)
 
 # --- Relational expression AST nodes ---
 
 class RelationalExpression(Expression):
+    __slots__ = ('left', 'right', 'n_aux', 'mode', 'circuit', 'inverse_circuit', 'circuit_args')
+    _dict_fields = (('left', 'left'), ('right', 'right'))
+
     def __init__(self, line: int, left: Union[Expression, int], right: Union[Expression, int]) -> None:
         """
         :param line: Line of code
@@ -495,288 +1159,178 @@ class RelationalExpression(Expression):
         super().__init__(line)
         assert isinstance(left, (Expression, int))
         assert isinstance(right, (Expression, int))
-        self.left = left
-        self.right = right
-        self.aux = None
-        self.mode = '' #can be '', 'rr', 'rc' or 'cr'
-
-    def get_leafs(self) -> Set[str]:
-        if isinstance(self.left, Expression) and isinstance(self.right, Expression):
-            return self.left.get_leafs().union(self.right.get_leafs())
-        elif isinstance(self.left, Expression) and isinstance(self.right, int):
-            return self.left.get_leafs()
-        else:
-            return self.right.get_leafs()
-
-    def to_dict(self) -> Dict[str, object]:
-        return {
-            'type': self.__class__.__name__,
-            'left': self.left if isinstance(self.left, int) else self.left.to_dict(),
-            'right': self.right if isinstance(self.right, int) else self.right.to_dict()
-        }
-    
-    def n_result_qubits(self, quantum_evaluator) -> int:
+        self.left = Parentheses.bypass(left)
+        self.right = Parentheses.bypass(right)
+        self.n_aux = 0 #Number of clean ancillas borrowed by the circuit, set by pre_build
+        self.mode = None #RelMode, set by pre_build
+        #qunits circuit, its inverse and the argument getter selected for the mode, set by pre_build
+        self.circuit = None
+        self.inverse_circuit = None
+        self.circuit_args = None
+
+    def iter_leafs(self) -> Iterator[str]:
+        if isinstance(self.left, Expression):
+            yield from self.left.iter_leafs()
+        if isinstance(self.right, Expression):
+            yield from self.right.iter_leafs()
+
+    def compute_n_result_qubits(self, quantum_evaluator) -> int:
         return 1
+
+    def compute_structural_key(self) -> Hashable:
+        left_key = operand_key(self.left)
+        right_key = operand_key(self.right)
+        if left_key is None or right_key is None:
+            return None
+        return (self._TYPE_NAME, left_key, right_key)
     
-    def pre_build(self, quantum_evaluator):
-        self.left = Parentheses.bypass(self.left)
-        self.right = Parentheses.bypass(self.right)
+    def prepare(self, quantum_evaluator):
         if isinstance(self.left, Expression) and isinstance(self.right, Expression):
-            self.mode = 'rr'
+            self.mode = RelMode.RR
         elif isinstance(self.left, Expression) and isinstance(self.right, int):
-            self.mode = 'rc'
+            self.mode = RelMode.RC
         else:
-            self.mode = 'cr'
+            self.mode = RelMode.CR
+        for op in self.operands_to_build():
+            op.pre_build(quantum_evaluator)
+        self.circuit = self._CIRCUITS[self.mode]
+        self.inverse_circuit = self._INVERSE_CIRCUITS[self.mode]
+        self.circuit_args = self._CIRCUIT_ARGS[self.mode]
+        self.n_aux = self._AUX_SIZES[self.mode](self, quantum_evaluator)
+
+    def operands_rr(self) -> Tuple[Expression, ...]:
+        return (self.left, self.right)
+
+    def operands_rc(self) -> Tuple[Expression, ...]:
+        return (self.left,)
+
+    def operands_cr(self) -> Tuple[Expression, ...]:
+        return (self.right,)
+
+    def circuit_args_rr(self) -> tuple:
+        return (self.left.result, self.right.result)
+
+    def circuit_args_rc(self) -> tuple:
+        return (self.left.result, self.right)
+
+    def circuit_args_cr(self) -> tuple:
+        return (self.right.result, self.left)
+
+    #Dispatch tables indexed by mode. The circuit arguments are the register operand followed by the other operand (register or constant).
+    _OPERANDS = {RelMode.RR: operands_rr, RelMode.RC: operands_rc, RelMode.CR: operands_cr}
+    _CIRCUIT_ARGS = {RelMode.RR: circuit_args_rr, RelMode.RC: circuit_args_rc, RelMode.CR: circuit_args_cr}
+    #qunits circuit functions, their inverses and the aux sizes of the circuits, indexed by mode, defined by each subclass
+    _CIRCUITS: Dict[RelMode, Callable] = {}
+    _INVERSE_CIRCUITS: Dict[RelMode, Callable] = {}
+    _AUX_SIZES: Dict[RelMode, Callable] = {}
+
+    def operands_to_build(self) -> Sequence[Expression]:
+        return self._OPERANDS[self.mode](self)
+
+    def n_borrowed_ancillas(self, quantum_evaluator) -> int:
+        return self.n_aux
+
+    def workspace(self, quantum_evaluator) -> List[qiskit.circuit.Qubit]:
+        """Returns the idle ancillas of the pool that the circuit can use as clean workspace after the aux qubits. They are not counted by n_borrowed_ancillas.
+
+        :return: List of qubits
+        :rtype: List[qiskit.circuit.Qubit]
+        """
+        return []
+
+    #The relational circuits uncompute their aux qubits, so the aux qubits are borrowed from the pool only around each circuit
+    def emit(self, quantum_evaluator):
+        aux = quantum_evaluator.alloc_ancillas(self.n_aux)
+        self.circuit(quantum_evaluator.quantum_circuit, *self.circuit_args(self), aux + self.workspace(quantum_evaluator), self.result[0])
+        quantum_evaluator.free_ancillas(aux)
+
+    def emit_inverse(self, quantum_evaluator):
+        aux = quantum_evaluator.alloc_ancillas(self.n_aux)
+        self.inverse_circuit(quantum_evaluator.quantum_circuit, *self.circuit_args(self), aux + self.workspace(quantum_evaluator), self.result[0])
+        quantum_evaluator.free_ancillas(aux)
 
 class Equal(RelationalExpression):
+    __slots__ = ()
+    _TYPE_NAME = 'Equal'
+    _CIRCUITS = {RelMode.RR: qunits.register_equal_register, RelMode.RC: qunits.register_equal_constant, RelMode.CR: qunits.register_equal_constant}
+    _INVERSE_CIRCUITS = {RelMode.RR: qunits.register_equal_register_dg, RelMode.RC: qunits.register_equal_constant_dg, RelMode.CR: qunits.register_equal_constant_dg}
+
     def __init__(self, line: int, left: Expression | int, right: Expression | int) -> None:
         super().__init__(line, left, right)
 
-    def pre_build(self, quantum_evaluator):
-        super().pre_build(quantum_evaluator)
-        if self.mode == 'rr':
-            self.left.pre_build(quantum_evaluator)
-            self.right.pre_build(quantum_evaluator)
-            n = max([self.left.n_result_qubits(quantum_evaluator), self.right.n_result_qubits(quantum_evaluator)]) - min([self.left.n_result_qubits(quantum_evaluator), self.right.n_result_qubits(quantum_evaluator)])
-            self.aux = [quantum_evaluator.alloc_ancilla() for i in range(n)]
-        elif self.mode == 'rc':
-            self.left.pre_build(quantum_evaluator)
-            n = max([math.ceil(math.log2(self.right)) - self.left.n_result_qubits(quantum_evaluator), 0])
-            self.aux = [quantum_evaluator.alloc_ancilla() for i in range(n)]
-        elif self.mode == 'cr':
-            self.right.pre_build(quantum_evaluator)
-            n = max([math.ceil(math.log2(self.left)) - self.right.n_result_qubits(quantum_evaluator), 0])
-            self.aux = [quantum_evaluator.alloc_ancilla() for i in range(n)]
-        else:
-            raise Exception('Undefined mode')
-        
-    def build(self, quantum_evaluator):
-        if self.mode == 'rr':
-            if self.left.needs_result_allocation(): self.left.alloc_result_qubits(quantum_evaluator)
-            if self.right.needs_result_allocation(): self.right.alloc_result_qubits(quantum_evaluator)
-            if not isinstance(self.left, Identifier): self.left.build(quantum_evaluator)
-            if not isinstance(self.right, Identifier): self.right.build(quantum_evaluator)
-            qunits.register_equal_register(quantum_evaluator.quantum_circuit, self.left.result, self.right.result, self.aux, self.result[0])
-        elif self.mode == 'rc':
-            if self.left.needs_result_allocation(): self.left.alloc_result_qubits(quantum_evaluator)
-            if not isinstance(self.left, Identifier): self.left.build(quantum_evaluator)
-            qunits.register_equal_constant(quantum_evaluator.quantum_circuit, self.left.result, self.right, self.aux, self.result[0])
-        elif self.mode == 'cr':
-            if self.right.needs_result_allocation(): self.right.alloc_result_qubits(quantum_evaluator)
-            if not isinstance(self.right, Identifier): self.right.build(quantum_evaluator)
-            qunits.register_equal_constant(quantum_evaluator.quantum_circuit, self.right.result, self.left, self.aux, self.result[0])
-        else:
-            raise Exception('Undefined mode')
-        
-    def reverse(self, quantum_evaluator):
-        if self.mode == 'rr':
-            qunits.register_equal_register_dg(quantum_evaluator.quantum_circuit, self.left.result, self.right.result, self.aux, self.result[0])
-            if not isinstance(self.left, Identifier): self.left.reverse(quantum_evaluator)
-            if not isinstance(self.right, Identifier): self.right.reverse(quantum_evaluator)
-            if self.left.needs_result_allocation(): self.left.release_result_qubits(quantum_evaluator)
-            if self.right.needs_result_allocation(): self.right.release_result_qubits(quantum_evaluator)
-        elif self.mode == 'rc':
-            qunits.register_equal_constant_dg(quantum_evaluator.quantum_circuit, self.left.result, self.right, self.aux, self.result[0])
-            if not isinstance(self.left, Identifier): self.left.reverse(quantum_evaluator)
-            if self.left.needs_result_allocation(): self.left.release_result_qubits(quantum_evaluator)
-        elif self.mode == 'cr':
-            qunits.register_equal_constant_dg(quantum_evaluator.quantum_circuit, self.right.result, self.left, self.aux, self.result[0])
-            if not isinstance(self.right, Identifier): self.right.reverse(quantum_evaluator)
-            if self.right.needs_result_allocation(): self.right.release_result_qubits(quantum_evaluator)
-        else:
-            raise Exception('Undefined mode')
+    #The aux qubits extend the shorter operand (or the register, up to the size of the constant)
+    def aux_size_rr(self, quantum_evaluator) -> int:
+        nl = self.left.n_result_qubits(quantum_evaluator)
+        nr = self.right.n_result_qubits(quantum_evaluator)
+        return abs(nl - nr)
+
+    def aux_size_const(self, quantum_evaluator) -> int:
+        reg, const = (self.left, self.right) if self.mode == RelMode.RC else (self.right, self.left)
+        return qunits.equal_constant_extension(reg.n_result_qubits(quantum_evaluator), const)
+
+    #The MCX of the comparison has the extended operand as controls. It is synthesized as a v-chain (see qunits.mcx_with_ancillas) only if the pool has enough idle ancillas when the comparison is emitted, so the v-chain never adds qubits to the circuit.
+    def workspace(self, quantum_evaluator) -> List[qiskit.circuit.Qubit]:
+        n_controls = self.n_aux + min(op.n_result_qubits(quantum_evaluator) for op in self.operands_to_build())
+        return quantum_evaluator.idle_ancillas(qunits.mcx_n_ancillas(n_controls))
+
+    _AUX_SIZES = {RelMode.RR: aux_size_rr, RelMode.RC: aux_size_const, RelMode.CR: aux_size_const}
 
 class NotEqual(RelationalExpression):
+    __slots__ = ()
+    _TYPE_NAME = 'NotEqual'
+    _CIRCUITS = {RelMode.RR: qunits.register_not_equal_register, RelMode.RC: qunits.register_not_equal_constant, RelMode.CR: qunits.register_not_equal_constant}
+    _INVERSE_CIRCUITS = {RelMode.RR: qunits.register_not_equal_register_dg, RelMode.RC: qunits.register_not_equal_constant_dg, RelMode.CR: qunits.register_not_equal_constant_dg}
+    #The not-equal circuits use the same aux qubits as the equal circuits
+    _AUX_SIZES = Equal._AUX_SIZES
+    workspace = Equal.workspace
+
     def __init__(self, line: int, left: Expression | int, right: Expression | int) -> None:
         super().__init__(line, left, right)
 
-    def pre_build(self, quantum_evaluator):
-        super().pre_build(quantum_evaluator)
-        if self.mode == 'rr':
-            self.left.pre_build(quantum_evaluator)
-            self.right.pre_build(quantum_evaluator)
-            nl = self.left.n_result_qubits(quantum_evaluator)
-            nr = self.right.n_result_qubits(quantum_evaluator)
-            n = max([nl, nr]) - min([nl, nr])
-            self.aux = [quantum_evaluator.alloc_ancilla() for i in range(n)]
-        elif self.mode == 'rc':
-            self.left.pre_build(quantum_evaluator)
-            n = max([math.ceil(math.log2(self.right)) - self.left.n_result_qubits(quantum_evaluator), 0])
-            self.aux = [quantum_evaluator.alloc_ancilla() for i in range(n)]
-        elif self.mode == 'cr':
-            self.right.pre_build(quantum_evaluator)
-            n = max([math.ceil(math.log2(self.left)) - self.right.n_result_qubits(quantum_evaluator), 0])
-            self.aux = [quantum_evaluator.alloc_ancilla() for i in range(n)]
-        else:
-            raise Exception('Undefined mode')
-        
-    def build(self, quantum_evaluator):
-        if self.mode == 'rr':
-            if self.left.needs_result_allocation(): self.left.alloc_result_qubits(quantum_evaluator)
-            if self.right.needs_result_allocation(): self.right.alloc_result_qubits(quantum_evaluator)
-            if not isinstance(self.left, Identifier): self.left.build(quantum_evaluator)
-            if not isinstance(self.right, Identifier): self.right.build(quantum_evaluator)
-            qunits.register_not_equal_register(quantum_evaluator.quantum_circuit, self.left.result, self.right.result, self.aux, self.result[0])
-        elif self.mode == 'rc':
-            if self.left.needs_result_allocation(): self.left.alloc_result_qubits(quantum_evaluator)
-            if not isinstance(self.left, Identifier): self.left.build(quantum_evaluator)
-            qunits.register_not_equal_constant(quantum_evaluator.quantum_circuit, self.left.result, self.right, self.aux, self.result[0])
-        elif self.mode == 'cr':
-            if self.right.needs_result_allocation(): self.right.alloc_result_qubits(quantum_evaluator)
-            if not isinstance(self.right, Identifier): self.right.build(quantum_evaluator)
-            qunits.register_not_equal_constant(quantum_evaluator.quantum_circuit, self.right.result, self.left, self.aux, self.result[0])
-        else:
-            raise Exception('Undefined mode')
-        
-    def reverse(self, quantum_evaluator):
-        if self.mode == 'rr':
-            qunits.register_not_equal_register_dg(quantum_evaluator.quantum_circuit, self.left.result, self.right.result, self.aux, self.result[0])
-            if not isinstance(self.left, Identifier): self.left.reverse(quantum_evaluator)
-            if not isinstance(self.right, Identifier): self.right.reverse(quantum_evaluator)
-            if self.left.needs_result_allocation(): self.left.release_result_qubits(quantum_evaluator)
-            if self.right.needs_result_allocation(): self.right.release_result_qubits(quantum_evaluator)
-        elif self.mode == 'rc':
-            qunits.register_not_equal_constant_dg(quantum_evaluator.quantum_circuit, self.left.result, self.right, self.aux, self.result[0])
-            if not isinstance(self.left, Identifier): self.left.reverse(quantum_evaluator)
-            if self.left.needs_result_allocation(): self.left.release_result_qubits(quantum_evaluator)
-        elif self.mode == 'cr':
-            qunits.register_not_equal_constant_dg(quantum_evaluator.quantum_circuit, self.right.result, self.left, self.aux, self.result[0])
-            if not isinstance(self.right, Identifier): self.right.reverse(quantum_evaluator)
-            if self.right.needs_result_allocation(): self.right.release_result_qubits(quantum_evaluator)
-        else:
-            raise Exception('Undefined mode')
+#Base of LessThan and GreaterThan. A greater-than is a less-than with swapped operands, so both share the aux sizes, written in terms of the lesser and greater operands.
+class InequalityExpression(RelationalExpression):
+    __slots__ = ()
+    _SWAPPED = False #If True, the left operand is the greater one
 
-class LessThan(RelationalExpression):
     def __init__(self, line: int, left: Expression | int, right: Expression | int) -> None:
         super().__init__(line, left, right)
 
-    def pre_build(self, quantum_evaluator):
-        super().pre_build(quantum_evaluator)
-        if self.mode == 'rr':
-            self.left.pre_build(quantum_evaluator)
-            self.right.pre_build(quantum_evaluator)
-            nl = self.left.n_result_qubits(quantum_evaluator)
-            nr = self.right.n_result_qubits(quantum_evaluator)
-            n = (nr - nl if nr > nl else 0) + 1
-            self.aux = [quantum_evaluator.alloc_ancilla() for i in range(n)]
-        elif self.mode == 'rc':
-            self.left.pre_build(quantum_evaluator)
-            nl = self.left.n_result_qubits(quantum_evaluator) 
-            m = nl - max([nl, math.ceil(math.log2(self.right))])
-            n = max([m, 0]) + 1
-            self.aux = [quantum_evaluator.alloc_ancilla() for i in range(n)]
-        elif self.mode == 'cr':
-            self.right.pre_build(quantum_evaluator)
-            nr = self.right.n_result_qubits(quantum_evaluator) 
-            m = nr - max([nr, math.ceil(math.log2(self.left))])
-            n = max([m, 0]) + 1
-            self.aux = [quantum_evaluator.alloc_ancilla() for i in range(n)]
-        else:
-            raise Exception('Undefined mode')
-        
-    def build(self, quantum_evaluator):
-        if self.mode == 'rr':
-            if self.left.needs_result_allocation(): self.left.alloc_result_qubits(quantum_evaluator)
-            if self.right.needs_result_allocation(): self.right.alloc_result_qubits(quantum_evaluator)
-            if not isinstance(self.left, Identifier): self.left.build(quantum_evaluator)
-            if not isinstance(self.right, Identifier): self.right.build(quantum_evaluator)
-            qunits.register_less_than_register(quantum_evaluator.quantum_circuit, self.left.result, self.right.result, self.aux, self.result[0])
-        elif self.mode == 'rc':
-            if self.left.needs_result_allocation(): self.left.alloc_result_qubits(quantum_evaluator)
-            if not isinstance(self.left, Identifier): self.left.build(quantum_evaluator)
-            qunits.register_less_than_constant(quantum_evaluator.quantum_circuit, self.left.result, self.right, self.aux, self.result[0])
-        elif self.mode == 'cr':
-            if self.right.needs_result_allocation(): self.right.alloc_result_qubits(quantum_evaluator)
-            if not isinstance(self.right, Identifier): self.right.build(quantum_evaluator)
-            qunits.register_greater_than_constant(quantum_evaluator.quantum_circuit, self.right.result, self.left, self.aux, self.result[0])
-        else:
-            raise Exception('Undefined mode')
-        
-    def reverse(self, quantum_evaluator):
-        if self.mode == 'rr':
-            qunits.register_less_than_register_dg(quantum_evaluator.quantum_circuit, self.left.result, self.right.result, self.aux, self.result[0])
-            if not isinstance(self.left, Identifier): self.left.reverse(quantum_evaluator)
-            if not isinstance(self.right, Identifier): self.right.reverse(quantum_evaluator)
-            if self.left.needs_result_allocation(): self.left.release_result_qubits(quantum_evaluator)
-            if self.right.needs_result_allocation(): self.right.release_result_qubits(quantum_evaluator)
-        elif self.mode == 'rc':
-            qunits.register_less_than_constant_dg(quantum_evaluator.quantum_circuit, self.left.result, self.right, self.aux, self.result[0])
-            if not isinstance(self.left, Identifier): self.left.reverse(quantum_evaluator)
-            if self.left.needs_result_allocation(): self.left.release_result_qubits(quantum_evaluator)
-        elif self.mode == 'cr':
-            qunits.register_greater_than_constant_dg(quantum_evaluator.quantum_circuit, self.right.result, self.left, self.aux, self.result[0])
-            if not isinstance(self.right, Identifier): self.right.reverse(quantum_evaluator)
-            if self.right.needs_result_allocation(): self.right.release_result_qubits(quantum_evaluator)
-        else:
-            raise Exception('Undefined mode')
+    def aux_size_rr(self, quantum_evaluator) -> int:
+        lesser, greater = (self.right, self.left) if self._SWAPPED else (self.left, self.right)
+        n_lesser = lesser.n_result_qubits(quantum_evaluator)
+        n_greater = greater.n_result_qubits(quantum_evaluator)
+        return (n_greater - n_lesser if n_greater > n_lesser else 0) + 1
+
+    def aux_size_const(self, quantum_evaluator) -> int:
+        reg, const = (self.left, self.right) if self.mode == RelMode.RC else (self.right, self.left)
+        return qunits.inequality_constant_aux_size(reg.n_result_qubits(quantum_evaluator), const)
+
+    _AUX_SIZES = {RelMode.RR: aux_size_rr, RelMode.RC: aux_size_const, RelMode.CR: aux_size_const}
+
+class LessThan(InequalityExpression):
+    __slots__ = ()
+    _TYPE_NAME = 'LessThan'
+    _CIRCUITS = {RelMode.RR: qunits.register_less_than_register, RelMode.RC: qunits.register_less_than_constant, RelMode.CR: qunits.register_greater_than_constant}
+    _INVERSE_CIRCUITS = {RelMode.RR: qunits.register_less_than_register_dg, RelMode.RC: qunits.register_less_than_constant_dg, RelMode.CR: qunits.register_greater_than_constant_dg}
 
-class GreaterThan(RelationalExpression):
     def __init__(self, line: int, left: Expression | int, right: Expression | int) -> None:
         super().__init__(line, left, right)
 
-    def pre_build(self, quantum_evaluator):
-        super().pre_build(quantum_evaluator)
-        if self.mode == 'rr':
-            self.left.pre_build(quantum_evaluator)
-            self.right.pre_build(quantum_evaluator)
-            nl = self.left.n_result_qubits(quantum_evaluator)
-            nr = self.right.n_result_qubits(quantum_evaluator)
-            n = (nl - nr if nl > nr else 0) + 1
-            self.aux = [quantum_evaluator.alloc_ancilla() for i in range(n)]
-        elif self.mode == 'rc':
-            self.left.pre_build(quantum_evaluator)
-            nl = self.left.n_result_qubits(quantum_evaluator) 
-            m = nl - max([nl, math.ceil(math.log2(self.right))])
-            n = max([m, 0]) + 1
-            self.aux = [quantum_evaluator.alloc_ancilla() for i in range(n)]
-        elif self.mode == 'cr':
-            self.right.pre_build(quantum_evaluator)
-            nr = self.right.n_result_qubits(quantum_evaluator) 
-            m = nr - max([nr, math.ceil(math.log2(self.left))])
-            n = max([m, 0]) + 1
-            self.aux = [quantum_evaluator.alloc_ancilla() for i in range(n)]
-        else:
-            raise Exception('Undefined mode')
-        
-    def build(self, quantum_evaluator):
-        if self.mode == 'rr':
-            if self.left.needs_result_allocation(): self.left.alloc_result_qubits(quantum_evaluator)
-            if self.right.needs_result_allocation(): self.right.alloc_result_qubits(quantum_evaluator)
-            if not isinstance(self.left, Identifier): self.left.build(quantum_evaluator)
-            if not isinstance(self.right, Identifier): self.right.build(quantum_evaluator)
-            qunits.register_greater_than_register(quantum_evaluator.quantum_circuit, self.left.result, self.right.result, self.aux, self.result[0])
-        elif self.mode == 'rc':
-            if self.left.needs_result_allocation(): self.left.alloc_result_qubits(quantum_evaluator)
-            if not isinstance(self.left, Identifier): self.left.build(quantum_evaluator)
-            qunits.register_greater_than_constant(quantum_evaluator.quantum_circuit, self.left.result, self.right, self.aux, self.result[0])
-        elif self.mode == 'cr':
-            if self.right.needs_result_allocation(): self.right.alloc_result_qubits(quantum_evaluator)
-            if not isinstance(self.right, Identifier): self.right.build(quantum_evaluator)
-            qunits.register_less_than_constant(quantum_evaluator.quantum_circuit, self.right.result, self.left, self.aux, self.result[0])
-        else:
-            raise Exception('Undefined mode')
-        
-    def reverse(self, quantum_evaluator):
-        if self.mode == 'rr':
-            qunits.register_greater_than_register_dg(quantum_evaluator.quantum_circuit, self.left.result, self.right.result, self.aux, self.result[0])
-            if not isinstance(self.left, Identifier): self.left.reverse(quantum_evaluator)
-            if not isinstance(self.right, Identifier): self.right.reverse(quantum_evaluator)
-            if self.left.needs_result_allocation(): self.left.release_result_qubits(quantum_evaluator)
-            if self.right.needs_result_allocation(): self.right.release_result_qubits(quantum_evaluator)
-        elif self.mode == 'rc':
-            qunits.register_greater_than_constant_dg(quantum_evaluator.quantum_circuit, self.left.result, self.right, self.aux, self.result[0])
-            if not isinstance(self.left, Identifier): self.left.reverse(quantum_evaluator)
-            if self.left.needs_result_allocation(): self.left.release_result_qubits(quantum_evaluator)
-        elif self.mode == 'cr':
-            qunits.register_less_than_constant_dg(quantum_evaluator.quantum_circuit, self.right.result, self.left, self.aux, self.result[0])
-            if not isinstance(self.right, Identifier): self.right.reverse(quantum_evaluator)
-            if self.right.needs_result_allocation(): self.right.release_result_qubits(quantum_evaluator)
-        else:
-            raise Exception('Undefined mode')
+class GreaterThan(InequalityExpression):
+    __slots__ = ()
+    _TYPE_NAME = 'GreaterThan'
+    _SWAPPED = True
+    _CIRCUITS = {RelMode.RR: qunits.register_greater_than_register, RelMode.RC: qunits.register_greater_than_constant, RelMode.CR: qunits.register_less_than_constant}
+    _INVERSE_CIRCUITS = {RelMode.RR: qunits.register_greater_than_register_dg, RelMode.RC: qunits.register_greater_than_constant_dg, RelMode.CR: qunits.register_less_than_constant_dg}
+
+    def __init__(self, line: int, left: Expression | int, right: Expression | int) -> None:
+        super().__init__(line, left, right)
 
 # --- logic expression AST nodes ---
 
 class LogicExpression(Expression):
+    __slots__ = ()
+
     def __init__(self, line: int) -> None:
         """
         :param line: Line of code
@@ -784,10 +1338,42 @@ class LogicExpression(Expression):
         """
         super().__init__(line)
 
-    def n_result_qubits(self, quantum_evaluator) -> int:
+    def compute_n_result_qubits(self, quantum_evaluator) -> int:
         return 1
 
+    @staticmethod
+    def n_mcx_ancillas(n_ctrls: int) -> int:
+        """
+        :param n_ctrls: Number of controls
+        :type n_ctrls: int
+        :return: Number of clean ancillas that emit_mcx borrows for a gate with n_ctrls controls
+        :rtype: int
+        """
+        return n_ctrls - 2 if n_ctrls >= 3 else 0
+
+    def emit_mcx(self, quantum_evaluator, ctrls: List[qiskit.circuit.Qubit], ctrl_state: int):
+        """Append a multi-controlled X gate that targets the result qubit.
+        With 3 or more controls, the gate is decomposed as a v-chain, which is linear in the number of controls. The v-chain needs len(ctrls)-2 clean ancillas and leaves them clean, so they are borrowed from the pool only around the gate.
+
+        :param quantum_evaluator: Parent quantum evaluator
+        :type quantum_evaluator: QuantumEvaluator
+        :param ctrls: Control qubits
+        :type ctrls: List[qiskit.circuit.Qubit]
+        :param ctrl_state: Control state, the bit i is the state of ctrls[i] that activates the gate
+        :type ctrl_state: int
+        """
+        n_aux = self.n_mcx_ancillas(len(ctrls))
+        if n_aux == 0:
+            quantum_evaluator.quantum_circuit.append(MCXGate(len(ctrls), ctrl_state=ctrl_state), ctrls + [self.result[-1]])
+            return
+        aux = quantum_evaluator.alloc_ancillas(n_aux)
+        quantum_evaluator.quantum_circuit.append(MCXVChain(len(ctrls), ctrl_state=ctrl_state), ctrls + [self.result[-1]] + aux)
+        quantum_evaluator.free_ancillas(aux)
+
 class Not(LogicExpression):
+    __slots__ = ('operand',)
+    _dict_fields = (('operand', 'operand'),)
+
     def __init__(self, line: int, operand: Expression) -> None:
         """
         :param line: line of code
@@ -797,45 +1383,72 @@ class Not(LogicExpression):
         """
         super().__init__(line)
         assert isinstance(operand, Expression)
-        self.operand = operand
+        self.operand = Parentheses.bypass(operand)
 
-    def to_dict(self) -> Dict[str, object]:
-        return {
-            'type': 'Not',
-            'operand': self.operand if isinstance(self.operand, int) else self.operand.to_dict()
-        }
+    def iter_leafs(self) -> Iterator[str]:
+        yield from self.operand.iter_leafs()
 
-    def pre_build(self, quantum_evaluator):
-        Parentheses.bypass(self.operand)
+    def prepare(self, quantum_evaluator):
         self.operand.pre_build(quantum_evaluator)
     
-    def build(self, quantum_evaluator):
-        if self.operand.needs_result_allocation():
-            self.operand.alloc_result_qubits(quantum_evaluator)
-        if not isinstance(self.operand, Identifier):
-            self.operand.build(quantum_evaluator)
+    def compute_structural_key(self) -> Hashable:
+        key = self.operand.structural_key()
+        return None if key is None else ('Not', key)
+
+    def operands_to_build(self) -> Sequence[Expression]:
+        return (self.operand,)
+
+    def emit(self, quantum_evaluator):
         quantum_evaluator.quantum_circuit.cx(self.operand.result[-1], self.result[-1])
         quantum_evaluator.quantum_circuit.x(self.result[-1])
 
-    def reverse(self, quantum_evaluator):
+    def emit_inverse(self, quantum_evaluator):
         quantum_evaluator.quantum_circuit.x(self.result[-1])
         quantum_evaluator.quantum_circuit.cx(self.operand.result[-1], self.result[-1])
-        if not isinstance(self.operand, Identifier):
-            self.operand.reverse(quantum_evaluator)
-        if self.operand.needs_result_allocation():
-            self.operand.release_result_qubits(quantum_evaluator)
     
+def absorb_negations(operands: Sequence[Expression]) -> Tuple[List[Expression], int]:
+    """Strip the Not wrappers of the operands of a multi-controlled gate, turning each into an open control
+
+    :param operands: Operands of an And or Or node
+    :type operands: Sequence[Expression]
+    :return: Operands to build and the control state, where the bit i is 0 if the i-th operand was negated an odd number of times
+    :rtype: Tuple[List[Expression], int]
+    """
+    stripped = []
+    for op in operands:
+        inner, state = op, True
+        while type(inner) is Not:
+            inner, state = inner.operand, not state
+        stripped.append((inner, state))
+
+    filtered = []
+    ctrl_state = 0
+    for i, (op, (inner, state)) in enumerate(zip(operands, stripped)):
+        #An identifier is a register, so it would be passed twice to the gate if it was also used by another operand
+        #Identifiers are interned per line, so the same register is matched by label
+        if inner is not op and type(inner) is Identifier and sum(1 for other, _ in stripped if type(other) is Identifier and other.label == inner.label) > 1:
+            inner, state = op, True
+        filtered.append(inner)
+        if state:
+            ctrl_state |= 1 << i
+    return filtered, ctrl_state
+
 class And(LogicExpression):
-    def __init__(self, line: int, operands: List[Expression]) -> None:
+    __slots__ = ('operands', 'filtered_operands', 'ctrl_state')
+    _dict_fields = (('operands', 'operands'),)
+
+    def __init__(self, line: int, operands: Sequence[Expression]) -> None:
         """
         :param line: line of code
         :type line: int
         :param operands: self-descriptive
-        :type operands: List[Expression]
+        :type operands: Sequence[Expression]
         """
         super().__init__(line)
-        assert all([isinstance(operand, Expression) for operand in operands])
-        self.operands = operands
+        assert all(isinstance(operand, Expression) for operand in operands)
+        self.operands = [Parentheses.bypass(op) for op in operands] #A list, so the parser can extend it in place
+        self.filtered_operands = []
+        self.ctrl_state = 0
 
     @staticmethod
     def merge(line: int, left: Expression, right: Expression) -> object:
@@ -847,53 +1460,56 @@ class And(LogicExpression):
         :type left: Expression
         :param right: Right operand
         :type right: Expression
-        :return: Product object
-        :rtype: Product
+        :return: And object
+        :rtype: And
         """
         assert isinstance(left, Expression)
         assert isinstance(right, Expression)
-        left_operands_list = left.operands if isinstance(left, And) else [left]
-        right_operands_list = [right]
-        return And(line, left_operands_list + right_operands_list)
+        return And(line, merge_operands(And, left, right))
 
-    def to_dict(self) -> Dict[str, object]:
-        return {
-            'type': 'And',
-            'operands': [(op if isinstance(op, int) else op.to_dict()) for op in self.operands]
-        }
-    
-    def pre_build(self, quantum_evaluator):
-        for i in range(len(self.operands)):
-            self.operands[i] = Parentheses.bypass(self.operands[i])
-            self.operands[i].pre_build(quantum_evaluator)
+    def compute_structural_key(self) -> Hashable:
+        keys = tuple(op.structural_key() for op in self.operands)
+        return None if None in keys else ('And', keys)
 
-    def build(self, quantum_evaluator):
-        for i in range(len(self.operands)):
-            if self.operands[i].needs_result_allocation(): 
-                self.operands[i].alloc_result_qubits(quantum_evaluator)
-            if not isinstance(self.operands[i], Identifier):
-                self.operands[i].build(quantum_evaluator)
-        quantum_evaluator.quantum_circuit.mcx([op.result[-1] for op in self.operands], self.result[-1])
+    def iter_leafs(self) -> Iterator[str]:
+        for op in self.operands:
+            yield from op.iter_leafs()
 
-    def reverse(self, quantum_evaluator):
-        quantum_evaluator.quantum_circuit.mcx([op.result[-1] for op in self.operands], self.result[-1])
-        for i in range(len(self.operands)):
-            if not isinstance(self.operands[i], Identifier):
-                self.operands[i].reverse(quantum_evaluator)
-            if self.operands[i].needs_result_allocation(): 
-                self.operands[i].release_result_qubits(quantum_evaluator)
+    def prepare(self, quantum_evaluator):
+        for op in self.operands:
+            op.pre_build(quantum_evaluator)
+        self.filtered_operands, self.ctrl_state = absorb_negations(self.operands)
+
+    def operands_to_build(self) -> Sequence[Expression]:
+        return self.filtered_operands
+
+    def n_borrowed_ancillas(self, quantum_evaluator) -> int:
+        return self.n_mcx_ancillas(len(self.filtered_operands))
+
+    def emit(self, quantum_evaluator):
+        ctrls = [op.result[-1] for op in self.filtered_operands]
+        self.emit_mcx(quantum_evaluator, ctrls, self.ctrl_state)
+
+    def emit_inverse(self, quantum_evaluator):
+        ctrls = [op.result[-1] for op in self.filtered_operands]
+        self.emit_mcx(quantum_evaluator, ctrls, self.ctrl_state)
     
 class Or(LogicExpression):
-    def __init__(self, line: int, operands: List[Expression]) -> None:
+    __slots__ = ('operands', 'filtered_operands', 'ctrl_state')
+    _dict_fields = (('operands', 'operands'),)
+
+    def __init__(self, line: int, operands: Sequence[Expression]) -> None:
         """
         :param line: Line of code
         :type line: int
         :param operands: self-descriptive
-        :type operands: List[Expression]
+        :type operands: Sequence[Expression]
         """
         super().__init__(line)
-        assert all([isinstance(operand, Expression) for operand in operands])
-        self.operands = operands
+        assert all(isinstance(operand, Expression) for operand in operands)
+        self.operands = [Parentheses.bypass(op) for op in operands] #A list, so the parser can extend it in place
+        self.filtered_operands = []
+        self.ctrl_state = 0
 
     @staticmethod
     def merge(line: int, left: Expression, right: Expression) -> object:
@@ -905,50 +1521,47 @@ class Or(LogicExpression):
         :type left: Expression
         :param right: Right operand
         :type right: Expression
-        :return: Product object
-        :rtype: Product
+        :return: Or object
+        :rtype: Or
         """
         assert isinstance(left, Expression)
         assert isinstance(right, Expression)
-        left_operands_list = left.operands if isinstance(left, Or) else [left]
-        right_operands_list = [right]
-        return Or(line, left_operands_list + right_operands_list)
-    
-    def to_dict(self) -> Dict[str, object]:
-        return {
-            'type': 'Or',
-            'operands': [(op if isinstance(op, int) else op.to_dict()) for op in self.operands]
-        }
+        return Or(line, merge_operands(Or, left, right))
+
+    def compute_structural_key(self) -> Hashable:
+        keys = tuple(op.structural_key() for op in self.operands)
+        return None if None in keys else ('Or', keys)
     
-    def pre_build(self, quantum_evaluator):
-        for i in range(len(self.operands)):
-            self.operands[i] = Parentheses.bypass(self.operands[i])
-            self.operands[i].pre_build(quantum_evaluator)
+    def iter_leafs(self) -> Iterator[str]:
+        for op in self.operands:
+            yield from op.iter_leafs()
 
-    def build(self, quantum_evaluator):
-        for i in range(len(self.operands)):
-            if self.operands[i].needs_result_allocation(): 
-                self.operands[i].alloc_result_qubits(quantum_evaluator)
-            if not isinstance(self.operands[i], Identifier):
-                self.operands[i].build(quantum_evaluator)
-        quantum_evaluator.quantum_circuit.x([op.result[-1] for op in self.operands])
-        quantum_evaluator.quantum_circuit.mcx([op.result[-1] for op in self.operands], self.result[-1])
-        quantum_evaluator.quantum_circuit.x([op.result[-1] for op in self.operands])
+    def prepare(self, quantum_evaluator):
+        for op in self.operands:
+            op.pre_build(quantum_evaluator)
+        self.filtered_operands, self.ctrl_state = absorb_negations(self.operands)
+
+    def operands_to_build(self) -> Sequence[Expression]:
+        return self.filtered_operands
+
+    def n_borrowed_ancillas(self, quantum_evaluator) -> int:
+        return self.n_mcx_ancillas(len(self.filtered_operands))
+
+    def emit(self, quantum_evaluator):
+        #De Morgan: a or b = not (not a and not b), so every control is open unless its operand was negated
+        ctrls = [op.result[-1] for op in self.filtered_operands]
+        self.emit_mcx(quantum_evaluator, ctrls, ~self.ctrl_state & ((1 << len(ctrls)) - 1))
         quantum_evaluator.quantum_circuit.x(self.result[-1])
 
-    def reverse(self, quantum_evaluator):
+    def emit_inverse(self, quantum_evaluator):
+        ctrls = [op.result[-1] for op in self.filtered_operands]
         quantum_evaluator.quantum_circuit.x(self.result[-1])
-        quantum_evaluator.quantum_circuit.x([op.result[-1] for op in self.operands])
-        quantum_evaluator.quantum_circuit.mcx([op.result[-1] for op in self.operands], self.result[-1])
-        quantum_evaluator.quantum_circuit.x([op.result[-1] for op in self.operands])
-        for i in range(len(self.operands)):
-            if not isinstance(self.operands[i], Identifier):
-                self.operands[i].reverse(quantum_evaluator)
-            if self.operands[i].needs_result_allocation(): 
-                self.operands[i].release_result_qubits(quantum_evaluator) 
+        self.emit_mcx(quantum_evaluator, ctrls, ~self.ctrl_state & ((1 << len(ctrls)) - 1))
     
 # --- Register definition AST nodes ---
 class RegisterDefinition(ASTNode):
+    __slots__ = ('name', 'n')
+
     def __init__(self, line: int, name: str, n: int) -> None:
         """
         :param line: Line of code
@@ -965,6 +1578,9 @@ class RegisterDefinition(ASTNode):
         self.n = n
 
 class RegisterExpressionDefinition(RegisterDefinition):
+    __slots__ = ('expr', 'target', 'program')
+    _dict_fields = (('name', 'name'), ('size', 'n'), ('expr', 'expr'))
+
     def __init__(self, line: int, name: str, n: int, expr: Expression) -> None:
         """
         :param line: Line of code
@@ -980,23 +1596,17 @@ class RegisterExpressionDefinition(RegisterDefinition):
         assert isinstance(expr, Expression)
         self.expr = expr
         self.target = None
+        self.program = None
 
-    def to_dict(self) -> Dict[str, object]:
-        return {
-            'type': 'RegisterExpressionDefinition',
-            'name': self.name,
-            'size': self.n,
-            'expr': self.expr.to_dict()
-        }
-    
     def pre_build(self, quantum_evaluator):
         """Pre-build the inner expression tree
 
         :param quantum_evaluator: Parent quantum evaluator
         :type quantum_evaluator: QuantumEvaluator
         """
-        self.target = [qbit for qbit in quantum_evaluator.get_qiskit_register(self.name)]
+        self.target = quantum_evaluator.get_qubit_list(self.name)
         self.expr.pre_build(quantum_evaluator)
+        self.program = self.expr.trace() #Static section, replayed by every build and reverse
 
     def build(self, quantum_evaluator):
         """Build the quantum circuit that evaluates the inner expression and asign the result to the target register
@@ -1006,7 +1616,7 @@ class RegisterExpressionDefinition(RegisterDefinition):
         """
         #if self.expr.needs_result_allocation(): self.expr.alloc_result_qubits(quantum_evaluator)
         self.expr.result = self.target
-        self.expr.build(quantum_evaluator)
+        self.expr.build(quantum_evaluator, self.program)
         #qunits.register_by_register_addition(quantum_evaluator.quantum_circuit, self.expr.result, self.target)
 
     def reverse(self, quantum_evaluator):
@@ -1016,11 +1626,14 @@ class RegisterExpressionDefinition(RegisterDefinition):
         :type quantum_evaluator: QuantumEvaluator
         """
         #qunits.register_by_register_subtraction(quantum_evaluator.quantum_circuit, self.expr.result, self.target)
-        self.expr.reverse(quantum_evaluator)
+        self.expr.reverse(quantum_evaluator, self.program)
         #if self.expr.needs_result_allocation(): self.expr.release_result_qubits(quantum_evaluator)
 
 class RegisterSetDefinition(RegisterDefinition):
-    def __init__(self, line: int, name: str, n: int, values: Set[int]) -> None:
+    __slots__ = ('values',)
+    _dict_fields = (('name', 'name'), ('size', 'n'), ('values', 'values'))
+
+    def __init__(self, line: int, name: str, n: int, values: Iterable[int]) -> None:
         """
         :param line: Line of code
         :type line: int
@@ -1028,24 +1641,21 @@ class RegisterSetDefinition(RegisterDefinition):
         :type name: str
         :param n: Register's size
         :type n: int
-        :param expr: Target expression
-        :type expr: Expression
+        :param values: Superposed values. Duplicates are discarded.
+        :type values: Iterable[int]
         """
         super().__init__(line, name, n)
-        assert all([isinstance(v, int) for v in values])
-        self.values = values
+        if not isinstance(values, (set, frozenset)): #The parser already delivers a set, so it is not copied again
+            values = set(values)
+        assert all(isinstance(v, int) for v in values)
+        #Sorted array of machine integers: compact, deterministic order, and serializable as a list
+        self.values = array.array('q', sorted(values))
 
-    def to_dict(self) -> Dict[str, object]:
-        return {
-            'type': 'RegisterSetDefinition',
-            'name': self.name,
-            'size': self.n,
-            'values': self.values
-        }
-    
 # --- Terminators ---
 
 class Terminator(ASTNode):
+    __slots__ = ()
+
     def __init__(self, line: int) -> None:
         """
         :param line: Line of code
@@ -1054,6 +1664,9 @@ class Terminator(ASTNode):
         super().__init__(line)
 
 class Amplify(Terminator):
+    __slots__ = ('target', 'it')
+    _dict_fields = (('target', 'target'), ('iterations', 'it'))
+
     def __init__(self, line: int, target: str, iterations: int) -> None:
         """
         :param line: Line of code
@@ -1069,16 +1682,12 @@ class Amplify(Terminator):
         self.target = target
         self.it = iterations
 
-    def to_dict(self) -> Dict[str, object]:
-        return {
-            'type': 'Amplify',
-            'target': self.target,
-            'iterations': self.it
-        }
-    
 # --- Full code AST node ---
 
 class FullCode(ASTNode):
+    __slots__ = ('regdefseq', 'terminator', 'expr_defs', 'set_defs')
+    _dict_fields = (('sequence', 'regdefseq'), ('terminator', 'terminator'))
+
     def __init__(self, line: int, regdefseq: List[RegisterDefinition], terminator: Terminator) -> None:
         """
         :param line: Line of code
@@ -1090,23 +1699,19 @@ class FullCode(ASTNode):
         """
         super().__init__(line)
         assert isinstance(regdefseq, list)
-        assert all([isinstance(x, RegisterDefinition) for x in regdefseq])
+        assert all(isinstance(x, RegisterDefinition) for x in regdefseq)
         assert isinstance(terminator, Terminator)
         self.regdefseq = regdefseq
         self.terminator = terminator
+        #Definitions split by kind once, so the synthesizer does not filter regdefseq on every Grover iteration
+        self.expr_defs = tuple(x for x in regdefseq if isinstance(x, RegisterExpressionDefinition))
+        self.set_defs = tuple(x for x in regdefseq if isinstance(x, RegisterSetDefinition))
 
-    def to_dict(self) -> Dict[str, object]:
-        return {
-            'type': 'FullCode',
-            'sequence': [x.to_dict() for x in self.regdefseq],
-            'terminator': self.terminator.to_dict()
-        }
-    
-    def get_reg_names_sizes_and_sets(self) -> List[Tuple[str, int, set]]:
-        """Return a list with a tuple for each defined register. Each tuple have a label, a size and a set of values.
+    def get_reg_names_sizes_and_sets(self) -> List[Tuple[str, int, Sequence[int]]]:
+        """Return a list with a tuple for each defined register. Each tuple have a label, a size and a sorted sequence of values.
 
         :return: List of tuples
-        :rtype: List[Tuple[str, int, set]]
+        :rtype: List[Tuple[str, int, Sequence[int]]]
         """
         return [(reg.name, reg.n, reg.values) if isinstance(reg, RegisterSetDefinition) else (reg.name, reg.n, None) for reg in self.regdefseq]
     
@@ -1116,7 +1721,7 @@ class FullCode(ASTNode):
         :raises SynthError: Identifier already defined
         :raises SynthError: Identifier not defined
         """
-        defined_registers = []
+        defined_registers = set()
         for regdef in self.regdefseq:
             if regdef.name in defined_registers:
                 raise SynthError(regdef.line, f'"{regdef.name}" is already defined')
@@ -1124,7 +1729,7 @@ class FullCode(ASTNode):
                 for leaf in regdef.expr.get_leafs():
                     if not leaf in defined_registers:
                         raise SynthError(regdef.line, f'The identifier {leaf} is not defined')
-            defined_registers.append(regdef.name)
+            defined_registers.add(regdef.name)
 
         if isinstance(self.terminator, Amplify):
             if self.terminator.target not in defined_registers:
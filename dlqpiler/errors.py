@@ -0,0 +1,41 @@
+#Filipe Chagas, 2023
+
+#Exceptions raised by the lexer, the parser and the synthesizer when a DLQ code is invalid
+
+class DLQError(Exception):
+    #Name of the compilation stage that raises the error, used as prefix of the message
+    stage = 'Compilation'
+
+    def __init__(self, line: int, description: str) -> None:
+        """
+        :param line: Line of code, or None if the error happened at the end of the code
+        :type line: int
+        :param description: Description of the error
+        :type description: str
+        """
+        super().__init__(line, description)
+        self.line = line
+        self.description = description
+
+    def __str__(self) -> str:
+        #The message is formatted only when the error is printed
+        if isinstance(self.line, int): #Check if line is not None
+            return f'{self.stage} error at line {self.line}: {self.description}'
+        else:
+            return f'{self.stage} error at EOF: {self.description}'
+
+#Defines a custom exception for lexical errors
+class LexicalError(DLQError):
+    stage = 'Lexical'
+
+#Defines a custom exception for parsing errors
+class ParsingError(DLQError):
+    stage = 'Parsing'
+
+    @property
+    def message(self) -> str:
+        return self.description
+
+#Defines a custom exception for synthesis errors
+class SynthError(DLQError):
+    stage = 'Synthesis'
@@ -1,6 +1,9 @@
 #Filipe Chagas, 2023
 
+import os
+import sys
 import ply.lex as lex
+from dlqpiler.errors import LexicalError
 
 #This is a dictionary of reserved language words. 
 #It is necessary to create this dictionary so that lexer does not return these tokens as generic identifiers.
@@ -15,6 +18,9 @@ reserved = {
     'times': 'TIMES',
 }
 
+#Most identifiers are not reserved words, so t_ID tests this set before indexing the dictionary
+reserved_words = frozenset(sys.intern(word) for word in reserved)
+
 #This is a list with the names of the tokens.
 tokens = [
    'NUMBER',
@@ -75,7 +81,8 @@ def t_NUMBER(t):
 
 def t_ID(t):
     r'[a-zA-Z_][a-zA-Z_0-9]*'
-    t.type = reserved.get(t.value,'ID') #Check for reserved words
+    t.value = sys.intern(t.value) #Repeated identifiers share one string, which speeds up the later dictionary lookups by label
+    t.type = reserved[t.value] if t.value in reserved_words else 'ID' #Check for reserved words
     return t
 
 #Define a rule so we can track line numbers
@@ -86,14 +93,10 @@ def t_newline(t):
 #A string containing ignored characters (spaces and tabs)
 t_ignore  = ' \t'
 
-#Defines a custom exception for lexical errors
-class LexicalError(Exception):
-    def __init__(self, token) -> None:
-        super().__init__(f'Illegal character {token.value[0]}')
-
 #Error handling rule
 def t_error(t):
-    raise LexicalError(t)
+    raise LexicalError(t.lexer.lineno, f'Illegal character {t.value[0]}')
 
 #Build the lexer
-lexer = lex.lex()
\ No newline at end of file
+#In optimize mode, PLY loads the lexing tables from dlqpiler/_lextab.py instead of inspecting this module and compiling each rule again
+lexer = lex.lex(optimize=1, lextab='dlqpiler._lextab', outputdir=os.path.dirname(os.path.abspath(__file__)))
\ No newline at end of file
@@ -1,14 +1,60 @@
 #Filipe Chagas, 2023
+from __future__ import annotations
+import os
+import copy
+import importlib.util
+from functools import lru_cache
+from typing import TYPE_CHECKING
 from typer import Typer
-from dlqpiler import synth
 from dlqpiler import parser
-from ply import yacc
-from qiskit import Aer
-import pandas as pd
-from matplotlib import pyplot as plt
+
+#qiskit, pandas and matplotlib are slow to import, so they are imported by the functions that use them and the CLI starts without them
+if TYPE_CHECKING:
+    import pandas as pd
+    from dlqpiler import synth
 
 app = Typer()
 
+#If the DLQPILER_CACHE environment variable is 1, the quantum evaluators built by psim, pplot and get_qqc are cached by code, so the same code is compiled only once
+CACHE_ENABLED = os.environ.get('DLQPILER_CACHE', '0') == '1'
+
+#xlsxwriter is optional. If it is installed, the XLSX files are written by it in constant memory mode instead of by openpyxl.
+XLSXWRITER_AVAILABLE = importlib.util.find_spec('xlsxwriter') is not None
+
+def build_qe(code: str) -> synth.QuantumEvaluator:
+    """Compile a DLQ code
+
+    :param code: DLQ input code
+    :type code: str
+    :return: Quantum evaluator with the entire circuit built
+    :rtype: synth.QuantumEvaluator
+    """
+    from dlqpiler import synth
+    qe = synth.QuantumEvaluator(parser.parse(code))
+    qe.build_all()
+    return qe
+
+@lru_cache(maxsize=32)
+def build_qe_cached(code: str) -> synth.QuantumEvaluator:
+    """Cached version of build_qe. The returned evaluator is shared and must not be modified.
+
+    :param code: DLQ input code
+    :type code: str
+    :return: Quantum evaluator with the entire circuit built
+    :rtype: synth.QuantumEvaluator
+    """
+    return build_qe(code)
+
+def get_qe(code: str) -> synth.QuantumEvaluator:
+    """Return the quantum evaluator of a DLQ code, from the cache if it is enabled
+
+    :param code: DLQ input code
+    :type code: str
+    :return: Quantum evaluator with the entire circuit built
+    :rtype: synth.QuantumEvaluator
+    """
+    return build_qe_cached(code) if CACHE_ENABLED else build_qe(code)
+
 def psim(code: str, shots: int) -> pd.DataFrame:
     """Compile a DLQ code and make a simulation
 
@@ -19,9 +65,9 @@ def psim(code: str, shots: int) -> pd.DataFrame:
     :return: Result table
     :rtype: pd.DataFrame
     """
-    qe = synth.QuantumEvaluator(yacc.parse(code))
-    qe.build_all()
-    return qe.simulate(Aer.get_backend('aer_simulator'), shots=shots)
+    from qiskit import Aer
+    qe = get_qe(code)
+    return qe.simulate(Aer.get_backend('aer_simulator'), shots=shots, optimization_level=3)
 
 def pplot(code: str):
     """Compile a DLQ code and show it's quantum circuit using matplotlib
@@ -29,8 +75,8 @@ def pplot(code: str):
     :param code: DLQ input code
     :type code: str
     """
-    qe = synth.QuantumEvaluator(yacc.parse(code))
-    qe.build_all()
+    from matplotlib import pyplot as plt
+    qe = get_qe(code)
     qe.quantum_circuit.draw(output='mpl')
     plt.show()
 
@@ -42,17 +88,34 @@ def get_qqc(code: str):
     :return: self-descriptive
     :rtype: qiskit.QuantumCircuit
     """
-    qe = synth.QuantumEvaluator(yacc.parse(code))
-    qe.build_all()
-    return qe.quantum_circuit
+    qe = get_qe(code)
+    return copy.deepcopy(qe.quantum_circuit) if CACHE_ENABLED else qe.quantum_circuit
+
+def save_result(result: pd.DataFrame, destfn: str):
+    """Save a result table to a CSV file if destfn has the .csv extension, or to a XLSX file otherwise.
+    The DataFrame index is not written in either format, so both files have the same columns.
+
+    :param result: Result table
+    :type result: pd.DataFrame
+    :param destfn: Path to the output file
+    :type destfn: str
+    """
+    if destfn.lower().endswith('.csv'):
+        result.to_csv(destfn, index=False)
+    elif XLSXWRITER_AVAILABLE:
+        import pandas as pd
+        with pd.ExcelWriter(destfn, engine='xlsxwriter', engine_kwargs={'options': {'constant_memory': True}}) as writer:
+            result.to_excel(writer, index=False)
+    else:
+        result.to_excel(destfn, index=False)
 
 @app.command()
 def sim(codefn: str, destfn: str, shots: int):
-    """Execute a simulation of the given code and save it's results to a xlsx file
+    """Execute a simulation of the given code and save it's results to a xlsx or csv file
 
     :param codefn: Path to the code file
     :type codefn: str
-    :param destfn: Path to the XLSX file
+    :param destfn: Path to the XLSX or CSV file
     :type destfn: str
     :param shots: Number of simulation shots
     :type shots: int
@@ -60,7 +123,7 @@ def sim(codefn: str, destfn: str, shots: int):
     with open(codefn, 'r') as f:
         code = f.read()
         result = psim(code, shots)
-        result.to_excel(destfn)
+        save_result(result, destfn)
 
 @app.command()
 def plot(codefn: str):
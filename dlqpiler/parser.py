@@ -1,19 +1,12 @@
 #Filipe Chagas, 2023
 
+import os
+import operator
 from dlqpiler.lexer import *
 from dlqpiler import ast
+from dlqpiler.errors import ParsingError
 import ply.yacc as yacc
 
-#Defines a custom exception for parsing errors
-class ParsingError(Exception):
-    def __init__(self, line: int, message: str) -> None:
-        self.line = line
-        self.message = message
-        if isinstance(line, int): #Check if line is not None
-            super().__init__(f'Parsing error at line {line}: {message}')
-        else:
-            super().__init__(f'Parsing error at EOF: {message}')
-
 #Defines the precedence and associativity of unary and binary operators
 precedence = (
     ('left', 'OR'),
@@ -32,7 +25,7 @@ precedence = (
 #Root parsing rule
 def p_full_code(p):
     'fullcode : regdefseq amplifyterm'
-    p[0] = ast.FullCode(p.lineno(0), p[1], p[2])
+    p[0] = ast.FullCode(p.lexer.lineno, p[1], p[2])
 
 #Syntax of the amplify terminator
 def p_amplify_terminator(p):
@@ -41,14 +34,16 @@ def p_amplify_terminator(p):
     it = p[3]
 
     if it < 0:
-        raise ParsingError(p.lineno(0), 'The number of amplify iterations must be greater or equal to 0')
+        raise ParsingError(p.lexer.lineno, 'The number of amplify iterations must be greater or equal to 0')
     
-    p[0] = ast.Amplify(p.lineno(0), target, it)
+    p[0] = ast.Amplify(p.lexer.lineno, target, it)
 
 #Syntax of a sequence of register definitions separated by semicolons
+#The rule is left-recursive, so each definition is appended to the list in place
 def p_regdef_sequence_body(p):
-    'regdefseq : regdef SEMICOLON regdefseq'
-    p[0] = [p[1]] + p[3]
+    'regdefseq : regdefseq regdef SEMICOLON'
+    p[1].append(p[2])
+    p[0] = p[1]
 
 def p_regdef_sequence_tail(p):
     'regdefseq : regdef SEMICOLON'
@@ -69,12 +64,12 @@ def p_register_definition_set(p):
     seq = p[7]
     
     if n <= 0:
-        raise ParsingError(p.lineno(0), 'Register\'s size must be greater than 0')
-    
-    if not all([isinstance(v, int) for v in seq]):
-        raise ParsingError(p.lineno(0), 'A set must be composed only of constant values')
+        raise ParsingError(p.lexer.lineno, 'Register\'s size must be greater than 0')
+
+    if any(v < 0 or v >= 2**n for v in seq):
+        raise ParsingError(p.lexer.lineno, f'The values of register "{id}" must be naturals less than 2^{n}')
     
-    p[0] = ast.RegisterSetDefinition(p.lineno(0), id, n, set(seq))
+    p[0] = ast.RegisterSetDefinition(p.lexer.lineno, id, n, seq)
 
 #Statement for the definition of a register as an expression
 #Example: "myreg[8] := b^2 - 4*a*c" defines an 8-bit register as b^2-4*a*c
@@ -82,148 +77,133 @@ def p_register_definition_expression(p):
     'regdefx : ID LBRACKET NUMBER RBRACKET ASSIGN expression'
     id = p[1]
     n = p[3]
-    expr = p[6]
+    expr = ast.Parentheses.bypass(p[6]) #Only the grouping of an operand changes its result
 
     if n <= 0:
-        raise ParsingError(p.lineno(0), 'Register\'s size must be greater than 0')
+        raise ParsingError(p.lexer.lineno, 'Register\'s size must be greater than 0')
         
+    #Constant folding can reduce an expression like a*1, a+0, --a or a^0 to an identifier or a constant, so it is assigned as a product with a single factor, which copies the register or initializes the constant
     if isinstance(expr, (ast.Identifier, int)):
-        raise ParsingError(p.lineno(0), 'dlqpiler currently does not accept direct assignments or constants in registers, only logical, arithmetic and relational expressions.')
+        expr = ast.Product(p.lexer.lineno, [expr])
 
-    p[0] = ast.RegisterExpressionDefinition(p.lineno(0), id, n, expr)
+    p[0] = ast.RegisterExpressionDefinition(p.lexer.lineno, id, n, expr)
 
 
 # --- Parsing rules to expression sequences ---
+#Sequences are only used by set definitions, so each element is checked to be a constant as soon as it is reduced, and the elements are accumulated in place into a set
 def p_expression_sequence_fork(p):
     'expseq : expseq COMMA expression'
-    p[0] = p[1] + [p[3]]
+    if not isinstance(p[3], int):
+        raise ParsingError(p.lexer.lineno, 'A set must be composed only of constant values')
+    p[1].add(p[3])
+    p[0] = p[1]
 
 def p_expression_sequence_tail(p):
     'expseq : expression'
-    p[0] = [p[1]]
+    if not isinstance(p[1], int):
+        raise ParsingError(p.lexer.lineno, 'A set must be composed only of constant values')
+    p[0] = {p[1]}
 
 # --- Parsing rules to logic expressions ---
+#The binary rules test whether each operand is a constant once, then reuse the flags in every branch
+#Constant operands are folded with bitwise operations on their least significant bit
 def p_expression_or(p):
     'expression : expression OR expression'
-    if isinstance(p[1], int) and isinstance(p[3], int):
-        p[0] = int(bool(p[1] % 2) or bool(p[3] % 2))
-    elif isinstance(p[1], ast.Expression) and isinstance(p[3], int):
-        p[0] = 1 if bool(p[3] % 2) else p[1]
-    elif isinstance(p[1], int) and isinstance(p[3], ast.Expression):
-        p[0] = 1 if bool(p[1] % 2) else p[3]
+    lconst, rconst = isinstance(p[1], int), isinstance(p[3], int)
+    if lconst and rconst:
+        p[0] = (p[1] | p[3]) & 1
+    elif rconst and isinstance(p[1], ast.Expression):
+        p[0] = 1 if p[3] & 1 else p[1]
+    elif lconst and isinstance(p[3], ast.Expression):
+        p[0] = 1 if p[1] & 1 else p[3]
+    elif type(p[1]) is ast.Or and isinstance(p[3], ast.Expression):
+        p[0] = ast.extend_operands(p[1], p[3]) #The chain is flattened in place, like the chains of chain_operators
     elif isinstance(p[1], ast.Expression) and isinstance(p[3], ast.Expression):
-        p[0] = ast.Or.merge(p.lineno(0), p[1], p[3])
+        p[0] = ast.Or.merge(p.lexer.lineno, p[1], p[3])
     else:
-        raise ParsingError(p.lineno(0), f'It is not possible to apply the OR operator to types {(type(p[1]), type(p[3]))}')
+        raise ParsingError(p.lexer.lineno, f'It is not possible to apply the OR operator to types {(type(p[1]), type(p[3]))}')
     
 def p_expression_and(p):
     'expression : expression AND expression'
-    if isinstance(p[1], int) and isinstance(p[3], int):
-        p[0] = int(bool(p[1] % 2) and bool(p[3] % 2))
-    elif isinstance(p[1], ast.Expression) and isinstance(p[3], int):
-        p[0] = p[1] if bool(p[3] % 2) else 0
-    elif isinstance(p[1], int) and isinstance(p[3], ast.Expression):
-        p[0] = p[3] if bool(p[1] % 2) else 0
+    lconst, rconst = isinstance(p[1], int), isinstance(p[3], int)
+    if lconst and rconst:
+        p[0] = p[1] & p[3] & 1
+    elif rconst and isinstance(p[1], ast.Expression):
+        p[0] = p[1] if p[3] & 1 else 0
+    elif lconst and isinstance(p[3], ast.Expression):
+        p[0] = p[3] if p[1] & 1 else 0
+    elif type(p[1]) is ast.And and isinstance(p[3], ast.Expression):
+        p[0] = ast.extend_operands(p[1], p[3]) #The chain is flattened in place, like the chains of chain_operators
     elif isinstance(p[1], ast.Expression) and isinstance(p[3], ast.Expression):
-        p[0] = ast.And.merge(p.lineno(0), p[1], p[3])
+        p[0] = ast.And.merge(p.lexer.lineno, p[1], p[3])
     else:
-        raise ParsingError(p.lineno(0), f'It is not possible to apply the AND operator to types {(type(p[1]), type(p[3]))}')
+        raise ParsingError(p.lexer.lineno, f'It is not possible to apply the AND operator to types {(type(p[1]), type(p[3]))}')
 
 def p_expression_not(p):
     'expression : NOT expression'    
     if isinstance(p[2], int):
-        p[0] = int(not bool(p[2] % 2))
+        p[0] = ~p[2] & 1
     elif isinstance(p[2], (ast.Expression, int)):
-        p[0] = ast.Not(p.lineno(0), p[2])
+        p[0] = ast.Not(p.lexer.lineno, p[2])
     else:
-        raise ParsingError(p.lineno(0), f'It is not possible to apply the NOT operator to type {type(p[2])}')
+        raise ParsingError(p.lexer.lineno, f'It is not possible to apply the NOT operator to type {type(p[2])}')
     
-# --- Parsing rules to relational expressions ---
-
-#Parsing rule to the equal operator ('=')
-def p_expression_equal(p):
-    'expression : expression EQUAL expression'
-    if isinstance(p[1], int) and isinstance(p[3], int):
-        p[0] = p[1] == p[3]
-    elif isinstance(p[1], (ast.Expression, int)) and isinstance(p[3], (ast.Expression, int)):
-        p[0] = ast.Equal(p.lineno(0), p[1], p[3])
-    else:
-        raise ParsingError(p.lineno(0), f'It is not possible to apply the equal operator to types {(type(p[1]), type(p[3]))}')
-
-#Parsing rule to the not-equal operator ('!=')
-def p_expression_not_equal(p):
-    'expression : expression NEQ expression'
-    if isinstance(p[1], int) and isinstance(p[3], int):
-        p[0] = p[1] != p[3]
-    elif isinstance(p[1], (ast.Expression, int)) and isinstance(p[3], (ast.Expression, int)):
-        p[0] = ast.NotEqual(p.lineno(0), p[1], p[3])
+# --- Parsing rules to relational and arithmetic expressions ---
+
+#Binary operators that fold two constant operands and build an AST node otherwise
+#Maps the lexeme of the operator to (name used in error messages, constant folding function, AST node constructor)
+binary_operators = {
+    '=': ('equal', operator.eq, ast.Equal),
+    '!=': ('not-equal', operator.ne, ast.NotEqual),
+    '<': ('less-than', operator.lt, ast.LessThan),
+    '>': ('greater-than', operator.gt, ast.GreaterThan),
+    '+': ('addition', operator.add, ast.Summation.merge_add),
+    '-': ('subtraction', operator.sub, ast.Summation.merge_sub),
+    '*': ('product', operator.mul, ast.Product.merge),
+}
+
+#N-ary operators whose left-associative chains are flattened in place
+#Maps the lexeme of the operator to (AST node class, signal of the new operand, or None if the node has no signals)
+#The left operand of a reduction was built by the previous reduction of the chain and is not referenced anywhere else yet, so the new operand is appended to it instead of copying its operand list (which would make a chain quadratic). The merge constructors are kept pure.
+chain_operators = {
+    '+': (ast.Summation, ast.Signal.POS),
+    '-': (ast.Summation, ast.Signal.NEG),
+    '*': (ast.Product, None),
+}
+
+#Parsing rule to the relational ('=', '!=', '<', '>') and arithmetic ('+', '-', '*') binary operators
+def p_expression_binary(p):
+    '''expression : expression EQUAL expression
+                  | expression NEQ expression
+                  | expression LT expression
+                  | expression GT expression
+                  | expression PLUS expression
+                  | expression MINUS expression
+                  | expression MUL expression'''
+    name, fold, build = binary_operators[p[2]]
+    lconst, rconst = isinstance(p[1], int), isinstance(p[3], int)
+    chain = chain_operators.get(p[2])
+    if chain is not None and type(p[1]) is chain[0] and isinstance(p[3], ast.Expression) and type(p[3]) is not chain[0]:
+        p[0] = ast.insert_operand(p[1], p[3], chain[1])
+    elif lconst and rconst:
+        p[0] = fold(p[1], p[3])
+    elif (lconst or isinstance(p[1], ast.Expression)) and (rconst or isinstance(p[3], ast.Expression)):
+        p[0] = build(p.lexer.lineno, p[1], p[3])
     else:
-        raise ParsingError(p.lineno(0), f'It is not possible to apply the not-equal operator to types {(type(p[1]), type(p[3]))}')
-
-#Parsing rule to the less-than operator ('<')
-def p_expression_less_than(p):
-    'expression : expression LT expression'
-    if isinstance(p[1], int) and isinstance(p[3], int):
-        p[0] = p[1] < p[3]
-    elif isinstance(p[1], (ast.Expression, int)) and isinstance(p[3], (ast.Expression, int)):
-        p[0] = ast.LessThan(p.lineno(0), p[1], p[3])
-    else:
-        raise ParsingError(p.lineno(0), f'It is not possible to apply the less-than operator to types {(type(p[1]), type(p[3]))}')
-
-#Parsing rule to the greater-than operator ('>')
-def p_expression_greater_than(p):
-    'expression : expression GT expression'
-    if isinstance(p[1], int) and isinstance(p[3], int):
-        p[0] = p[1] > p[3]
-    elif isinstance(p[1], (ast.Expression, int)) and isinstance(p[3], (ast.Expression, int)):
-        p[0] = ast.GreaterThan(p.lineno(0), p[1], p[3])
-    else:
-        raise ParsingError(p.lineno(0), f'It is not possible to apply the greater-than operator to types {(type(p[1]), type(p[3]))}')
-
-# --- Parsing rules to arithmetic expressions ---
-
-#Parsing rule to the addition operator ('+')
-def p_expression_add(p):
-    'expression : expression PLUS expression'
-    if isinstance(p[1], int) and isinstance(p[3], int):
-        p[0] = p[1] + p[3]
-    elif isinstance(p[1], (ast.Expression, int)) and isinstance(p[3], (ast.Expression, int)):
-        p[0] = ast.Summation.merge_add(p.lineno(0), p[1], p[3])
-    else:
-        raise ParsingError(p.lineno(0), f'It is not possible to apply the addition operator to types {(type(p[1]), type(p[3]))}')
-
-#Parsing rule to the subtraction operator ('-')
-def p_expression_sub(p):
-    'expression : expression MINUS expression'
-    if isinstance(p[1], int) and isinstance(p[3], int):
-        p[0] = p[1] - p[3]
-    elif isinstance(p[1], (ast.Expression, int)) and isinstance(p[3], (ast.Expression, int)):
-        p[0] = ast.Summation.merge_sub(p.lineno(0), p[1], p[3])
-    else:
-        raise ParsingError(p.lineno(0), f'It is not possible to apply the subtraction operator to types {(type(p[1]), type(p[3]))}')
-
-#Parsing rule to the multiplication operator ('*')
-def p_expression_mul(p):
-    'expression : expression MUL expression'
-    if isinstance(p[1], int) and isinstance(p[3], int):
-        p[0] = p[1] * p[3]
-    elif isinstance(p[1], (ast.Expression, int)) and isinstance(p[3], (ast.Expression, int)):
-        p[0] = ast.Product.merge(p.lineno(0), p[1], p[3])
-    else:
-        raise ParsingError(p.lineno(0), f'It is not possible to apply the product operator to types {(type(p[1]), type(p[3]))}')
+        raise ParsingError(p.lexer.lineno, f'It is not possible to apply the {name} operator to types {(type(p[1]), type(p[3]))}')
     
 #Parsing rule to the division operator ('^')
 def p_expression_power(p):
     'expression : expression HAT expression'
     if isinstance(p[3], int):
         if isinstance(p[1], ast.Expression):
-            p[0] = ast.Power(p.lineno(0), p[1], p[3])
+            p[0] = ast.Power.merge(p.lexer.lineno, p[1], p[3])
         elif isinstance(p[1], int):
             p[0] = p[1]**p[3]
         else:
-            raise ParsingError(p.lineno(0), f'It\'s not possible to apply the power operator to a base of type {type(p[1])}')
+            raise ParsingError(p.lexer.lineno, f'It\'s not possible to apply the power operator to a base of type {type(p[1])}')
     else:
-        raise ParsingError(p.lineno(0), 'The power operator can only be used with constant exponent')
+        raise ParsingError(p.lexer.lineno, 'The power operator can only be used with constant exponent')
     
 #Parsing rule to the division operator ('/')
 def p_expression_division(p):
@@ -231,25 +211,24 @@ def p_expression_division(p):
     if isinstance(p[1], int) and isinstance(p[3], int):
         p[0] = p[1]//p[3]
     else:
-        raise ParsingError(p.lineno(0), 'The division operator can only be applied to constant numeric values')
+        raise ParsingError(p.lexer.lineno, 'The division operator can only be applied to constant numeric values')
 
 #Parsing rule to unary minus
 def p_expression_uminus(p):
     'expression : MINUS expression %prec UMINUS'
     if isinstance(p[2], ast.Expression):
-        p[0] = ast.UnaryMinus(p.lineno(0), p[2])
+        p[0] = ast.UnaryMinus.merge(p.lexer.lineno, p[2])
     elif isinstance(p[2], int):
         p[0] = -p[2]
     else:
-        raise ParsingError(p.lineno(0), f'It\'s not possible to apply the unary minus operator to {type(p[2])}')
+        raise ParsingError(p.lexer.lineno, f'It\'s not possible to apply the unary minus operator to {type(p[2])}')
 
 #Parsing rule to expressions in parentheses
+#The grouping is already encoded in the tree shape, so the inner expression is returned without a Parentheses node
+#The exception is a summation: its result register is one qubit wider than its widest operand, so flattening a grouped summation into an outer chain would narrow it. The Parentheses node keeps it nested.
 def p_expression_parentheses(p):
     'expression : LPAREN expression RPAREN'
-    if isinstance(p[2], int): #If the inner expression is a value, return the value
-        p[0] = p[2]
-    else:
-        p[0] = ast.Parentheses(p.lineno(0), p[2])
+    p[0] = ast.Parentheses(p.lexer.lineno, p[2]) if type(p[2]) is ast.Summation else p[2]
 
 # --- Parsing rules to values and identifiers ---
 
@@ -259,7 +238,7 @@ def p_expression_false(p):
 
 def p_expression_true(p):
     'expression : TRUE'
-    p[0] =  1
+    p[0] = 1
 
 def p_expression_number(p):
     'expression : NUMBER'
@@ -267,14 +246,27 @@ def p_expression_number(p):
 
 def p_expression_id(p):
     'expression : ID'
-    p[0] = ast.Identifier(p.lineno(0), p[1])
+    p[0] = ast.Identifier.intern(p.lexer.lineno, p[1])
 
 #Defines a function to handle syntax errors
 def p_error(p):
     if p:
-        raise ParsingError(p.lineno(0), 'Invalid syntax')
+        raise ParsingError(p.lineno, 'Invalid syntax')
     else:
         raise ParsingError(None, 'Invalid syntax')
 
 #Build the parser
-parser = yacc.yacc()
\ No newline at end of file
+#PLY loads the LALR tables from dlqpiler/_parsetab.py and only generates them again if the grammar changes. No parser.out debug file is written.
+parser = yacc.yacc(debug=False, write_tables=True, tabmodule='dlqpiler._parsetab', outputdir=os.path.dirname(os.path.abspath(__file__)))
+
+def parse(code: str) -> ast.FullCode:
+    """Parse a DLQ code.
+    The parsing rules take the line of each node from the lexer (p.lexer.lineno), so the line counter is reset before parsing.
+
+    :param code: DLQ input code
+    :type code: str
+    :return: AST of the program
+    :rtype: ast.FullCode
+    """
+    lexer.lineno = 1
+    return parser.parse(code, lexer=lexer)
@@ -2,45 +2,46 @@
 
 import qiskit
 from itertools import product
+from functools import lru_cache
 from dlqpiler.utils import natural_to_binary
-from math import *
+from math import pi, acos, sqrt
 from typing import *
 
-def qft(n: int) -> qiskit.circuit.Gate:
+@lru_cache(maxsize=None)
+def qft(n: int, do_swaps: bool = True) -> qiskit.circuit.Gate:
     """Returns a QFT gate for n qubits.
+    The gate only depends on n and do_swaps, so it is built once and shared by every adder of the same size.
 
     :param n: Number of target qubits.
     :type n: int
+    :param do_swaps: If False, the final swaps that reverse the order of the qubits are omitted, defaults to True
+    :type do_swaps: bool, optional
     :return: QFT gate.
     :rtype: qiskit.circuit.Gate
     """
-    def rotations(my_circuit: qiskit.circuit.Gate, m: int):
-        if m == 0:
-            return my_circuit
-        else:
-            my_circuit.h(m-1) #Add a Haddamard gate to the most significant qubit
-        
-            for i in range(m-1):
-                my_circuit.crz(pi/(2**(m-1-i)), i, m-1)
-
-            rotations(my_circuit, m-1) 
-    
     my_circuit = qiskit.QuantumCircuit(n, name='QFT')
-    
-    rotations(my_circuit, n)
 
-    for m in range(n//2):
-        my_circuit.swap(m, n-m-1)
+    for m in range(n, 0, -1):
+        my_circuit.h(m-1) #Add a Haddamard gate to the most significant qubit
+
+        for i in range(m-1):
+            my_circuit.crz(pi / (1 << (m-1-i)), i, m-1)
+
+    if do_swaps:
+        for m in range(n//2):
+            my_circuit.swap(m, n-m-1)
 
     return my_circuit.to_gate()
 
 # --- Arithmetic circuits ---
 
+@lru_cache(maxsize=1024)
 def register_by_constant_addition(n: int, c: int) -> qiskit.circuit.Gate:
     """
     Register-by-constant addition gate (simplified draper adder).
     Get a gate to perform an addition of a constant $c$ to a integer register.
     No ancillary qubits needed.
+    The gate is cached by (n, c), so the register-by-register operations and the products reuse it instead of building the QFT sandwich again.
 
     :param n: Number of target qubits.
     :type n: int
@@ -51,19 +52,61 @@ def register_by_constant_addition(n: int, c: int) -> qiskit.circuit.Gate:
     """
     assert n > 0
 
+    if c % (1 << n) == 0:
+        #Adding a multiple of 2**n is the identity, so the QFT sandwich is omitted.
+        #Only the global phase of the rotations (-1 if c/2**n is odd) is kept, because it becomes a relative phase when the gate is controlled.
+        return qiskit.QuantumCircuit(n, name=f'$U_+({c})$', global_phase=pi if c >> n & 1 else 0).to_gate()
+
     my_circuit = qiskit.QuantumCircuit(n, name=f'$U_+({c})$')
 
-    my_qft = qft(n)
+    #The swaps at the end of the QFT and at the beginning of the inverse QFT cancel out if the phase of each qubit is applied to its swapped position.
+    #So the phase layer is applied in the Fourier basis without swaps, where qubit j receives the rotation c*pi/2**j.
+    my_qft = qft(n, do_swaps=False)
     my_circuit.append(my_qft, list(range(n)))
 
-    for i in range(n):
-        theta = c * (pi / (2**(n-i-1)))
-        my_circuit.rz(theta, i)
+    for j in range(n):
+        #RZ has period 4*pi, so c is reduced modulo 2**(j+2) and the rotations that are exactly the identity are skipped
+        k = c % (1 << (j+2))
+        if k != 0:
+            my_circuit.rz(k * (pi / (1 << j)), j)
 
     my_circuit.append(my_qft.inverse(), list(range(n)))
 
     return my_circuit.to_gate()
 
+@lru_cache(maxsize=1024)
+def register_by_constant_addition_dg(n: int, c: int) -> qiskit.circuit.Gate:
+    """Inverse of the register-by-constant addition gate, cached like register_by_constant_addition.
+
+    :param n: Number of target qubits.
+    :type n: int
+    :param c: Constant of the addition to invert.
+    :type c: int
+    :return: Inverse RCA gate.
+    :rtype: qiskit.circuit.Gate
+    """
+    return register_by_constant_addition(n, c).inverse()
+
+@lru_cache(maxsize=1024)
+def controlled_constant_addition(n: int, c: int, num_ctrl: int, inverse: bool = False) -> qiskit.circuit.Gate:
+    """Returns the register-by-constant addition gate (or its inverse) with num_ctrl control qubits.
+    Building a controlled gate is expensive, so it is cached by (n, c, num_ctrl, inverse).
+    Its qubits are the num_ctrl control qubits followed by the n target qubits.
+
+    :param n: Number of target qubits.
+    :type n: int
+    :param c: Constant to add.
+    :type c: int
+    :param num_ctrl: Number of control qubits.
+    :type num_ctrl: int
+    :param inverse: If True, control the inverse addition, defaults to False
+    :type inverse: bool, optional
+    :return: Controlled RCA gate.
+    :rtype: qiskit.circuit.Gate
+    """
+    adder = register_by_constant_addition_dg(n, c) if inverse else register_by_constant_addition(n, c)
+    return adder.control(num_ctrl) if num_ctrl > 0 else adder #The constant term of a product has no controls
+
 def register_by_register_addition(circ: qiskit.QuantumCircuit, src_reg: List[qiskit.circuit.Qubit], target_reg: List[qiskit.circuit.Qubit]):
     """Build a register-by-register addition circuit
 
@@ -75,7 +118,7 @@ def register_by_register_addition(circ: qiskit.QuantumCircuit, src_reg: List[qis
     :type target_reg: List[qiskit.circuit.Qubit]
     """
     for i in range(len(src_reg)):
-        controlled_addition = register_by_constant_addition(len(target_reg), 2**i).control(1)
+        controlled_addition = controlled_constant_addition(len(target_reg), 1 << i, 1)
         circ.append(controlled_addition, [src_reg[i]]+target_reg)
 
 def register_by_register_addition_dg(circ: qiskit.QuantumCircuit, src_reg: List[qiskit.circuit.Qubit], target_reg: List[qiskit.circuit.Qubit]):
@@ -89,7 +132,7 @@ def register_by_register_addition_dg(circ: qiskit.QuantumCircuit, src_reg: List[
     :type target_reg: List[qiskit.circuit.Qubit]
     """
     for i in range(len(src_reg))[::-1]:
-        controlled_addition = register_by_constant_addition(len(target_reg), 2**i).inverse().control(1)
+        controlled_addition = controlled_constant_addition(len(target_reg), 1 << i, 1, inverse=True)
         circ.append(controlled_addition, [src_reg[i]]+target_reg)
 
 def register_by_register_subtraction(circ: qiskit.QuantumCircuit, src_reg: List[qiskit.circuit.Qubit], target_reg: List[qiskit.circuit.Qubit]):
@@ -103,7 +146,7 @@ def register_by_register_subtraction(circ: qiskit.QuantumCircuit, src_reg: List[
     :type target_reg: List[qiskit.circuit.Qubit]
     """
     for i in range(len(src_reg)):
-        controlled_addition = register_by_constant_addition(len(target_reg), -2**i).control(1)
+        controlled_addition = controlled_constant_addition(len(target_reg), -(1 << i), 1)
         circ.append(controlled_addition, [src_reg[i]]+target_reg)
 
 def register_by_register_subtraction_dg(circ: qiskit.QuantumCircuit, src_reg: List[qiskit.circuit.Qubit], target_reg: List[qiskit.circuit.Qubit]):
@@ -117,9 +160,40 @@ def register_by_register_subtraction_dg(circ: qiskit.QuantumCircuit, src_reg: Li
     :type target_reg: List[qiskit.circuit.Qubit]
     """
     for i in range(len(src_reg))[::-1]:
-        controlled_addition = register_by_constant_addition(len(target_reg), -2**i).inverse().control(1)
+        controlled_addition = controlled_constant_addition(len(target_reg), -(1 << i), 1, inverse=True)
         circ.append(controlled_addition, [src_reg[i]]+target_reg)
 
+@lru_cache(maxsize=None)
+def multiproduct_plan(sizes: Tuple[int, ...], exponents: Tuple[int, ...]) -> Tuple[Tuple[Tuple[Tuple[int, int], ...], int], ...]:
+    """Compute the controls of each controlled constant addition of a productory.
+    The plan only depends on the sizes of the bases and on the exponents, so it is computed once and replayed by every build and reverse.
+    Terms of the expanded product with the same set of control qubits (e.g. a_i*a_j and a_j*a_i, or a_i*a_i and a_i) are merged into a single addition of the sum of their weights.
+    Controlled constant additions commute and compose by adding their constants, so the merged plan performs the same operation with one adder per distinct control set.
+
+    :param sizes: Number of qubits of each base
+    :type sizes: Tuple[int, ...]
+    :param exponents: Exponent of each base
+    :type exponents: Tuple[int, ...]
+    :return: Sequence of (controls, weight) pairs, where controls has the (base index, qubit index) of each control qubit and the constant factor must be multiplied by weight
+    :rtype: Tuple[Tuple[Tuple[Tuple[int, int], ...], int], ...]
+    """
+    #The powers and the productory must be calculated as a sequence of controlled const additions
+    factors_indexes = [] #This list contains a sequence with the index of each factor E times, where E is the respective exponent
+    for i in range(len(exponents)):
+        factors_indexes += [i]*exponents[i]
+
+    n_bases = len(sizes)
+    weights = {} #Maps the control masks of each addition to its weight, in order of first appearance
+    for t in product(*[range(sizes[factor_index]) for factor_index in factors_indexes]): #Each tuple t have the indexes of the qubits that must be used as control of each register
+        masks = [0]*n_bases #Bitmask of the control qubits of each base, so repeated qubits are deduplicated by the OR
+        for factor_index, qubit_index in zip(factors_indexes, t):
+            masks[factor_index] |= 1 << qubit_index
+        masks = tuple(masks)
+        weights[masks] = weights.get(masks, 0) + (1 << sum(t))
+
+    #The masks are expanded to (base index, qubit index) pairs only once for each distinct set of controls
+    return tuple((tuple((factor_index, qubit_index) for factor_index in range(n_bases) for qubit_index in range(sizes[factor_index]) if masks[factor_index] >> qubit_index & 1), weight) for masks, weight in weights.items())
+
 def multiproduct(circ: qiskit.QuantumCircuit, bases: List[List[qiskit.circuit.Qubit]], exponents: List[int], result: List[qiskit.circuit.Qubit], constant: int = 1):
     """Build a circuit that perform a productory with constant exponents 
 
@@ -134,28 +208,12 @@ def multiproduct(circ: qiskit.QuantumCircuit, bases: List[List[qiskit.circuit.Qu
     :param constant: Constant factor, defaults to 1
     :type constant: int, optional
     """
-    #The powers and the productory must be calculated as a sequence of controlled const additions
-    factors_indexes = [] #This list contains a sequence with the index of each factor E times, where E is the respective exponent
-    for i in range(len(exponents)):
-        factors_indexes += [i]*exponents[i]
-    
-    for t in product(*[list(range(len(bases[factors_indexes[i]]))) for i in range(len(factors_indexes))]): #Each tuple t have the indexes of the qubits that must be used as control of each register
-        ctrl_idx = {factor_index:set() for factor_index in range(len(bases))} #This dict will map each factor's index to a set with it's control qubit's indexes
-        #fill the ctrl dict
-        for i in range(len(t)): 
-            ctrl_idx[factors_indexes[i]].add(t[i])
-
-        ctrl_qubits = [] #Control qubits
-        #fill the ctrl_qubits list 
-        for factor_index in ctrl_idx.keys():
-            for qubit_index in ctrl_idx[factor_index]:
-                ctrl_qubits.append(bases[factor_index][qubit_index])
-
-        c = constant*2**sum(t) #Constant to add
+    for controls, weight in multiproduct_plan(tuple(len(base) for base in bases), tuple(exponents)):
+        ctrl_qubits = [bases[factor_index][qubit_index] for factor_index, qubit_index in controls] #Control qubits
+        c = constant*weight #Constant to add
 
         #Append controled const addition
-        my_const_adder = register_by_constant_addition(len(result), c)
-        my_const_adder = my_const_adder.control(len(ctrl_qubits))
+        my_const_adder = controlled_constant_addition(len(result), c, len(ctrl_qubits))
         circ.append(my_const_adder, ctrl_qubits + result)
 
 
@@ -173,37 +231,41 @@ def multiproduct_dg(circ: qiskit.QuantumCircuit, bases: List[List[qiskit.circuit
     :param constant: Constant factor, defaults to 1
     :type constant: int, optional
     """
-    #The powers and the productory must be calculated as a sequence of controlled const additions
-    factors_indexes = [] #This list contains a sequence with the index of each factor E times, where E is the respective exponent
-    for i in range(len(exponents)):
-        factors_indexes += [i]*exponents[i]
-
-    instructions = []
-    
-    for t in product(*[list(range(len(bases[factors_indexes[i]]))) for i in range(len(factors_indexes))]): #Each tuple t have the indexes of the qubits that must be used as control of each register
-        ctrl_idx = {factor_index:set() for factor_index in range(len(bases))} #This dict will map each factor's index to a set with it's control qubit's indexes
-        #fill the ctrl dict
-        for i in range(len(t)): 
-            ctrl_idx[factors_indexes[i]].add(t[i])
-
-        ctrl_qubits = [] #Control qubits
-        #fill the ctrl_qubits list 
-        for factor_index in ctrl_idx.keys():
-            for qubit_index in ctrl_idx[factor_index]:
-                ctrl_qubits.append(bases[factor_index][qubit_index])
-
-        c = constant*2**sum(t) #Constant to add
+    for controls, weight in multiproduct_plan(tuple(len(base) for base in bases), tuple(exponents))[::-1]:
+        ctrl_qubits = [bases[factor_index][qubit_index] for factor_index, qubit_index in controls] #Control qubits
+        c = constant*weight #Constant to add
 
         #Append controled const addition
-        my_const_adder = register_by_constant_addition(len(result), -c)
-        my_const_adder = my_const_adder.control(len(ctrl_qubits))
-        instructions.append((my_const_adder, ctrl_qubits + result))
-
-    for ins, qbts in instructions[::-1]:
-        circ.append(ins, qbts)
+        my_const_adder = controlled_constant_addition(len(result), -c, len(ctrl_qubits))
+        circ.append(my_const_adder, ctrl_qubits + result)
 
 # --- Relational circuits ---
 
+@lru_cache(maxsize=1024)
+def less_than_register_gate(n_left: int, n_right: int, n_aux: int) -> qiskit.circuit.Gate:
+    """Returns the gate of the less-than operation between two registers.
+    The right operand is subtracted from the left operand extended by the ancilla qubits, the sign bit is copied to the result and the subtraction is undone.
+    The gate only depends on the sizes, so the controlled adders are built once and the gate is replayed by every comparison with the same sizes.
+    Its qubits are the n_left qubits of the left operand, followed by the n_right qubits of the right operand, the n_aux ancilla qubits and the result qubit.
+
+    :param n_left: Number of qubits of the left operand
+    :type n_left: int
+    :param n_right: Number of qubits of the right operand
+    :type n_right: int
+    :param n_aux: Number of ancilla qubits
+    :type n_aux: int
+    :return: Comparison gate
+    :rtype: qiskit.circuit.Gate
+    """
+    my_circuit = qiskit.QuantumCircuit(n_left + n_right + n_aux + 1, name='$<$')
+    qubits = my_circuit.qubits
+    right = qubits[n_left:n_left + n_right]
+    xleft = qubits[:n_left] + qubits[n_left + n_right:n_left + n_right + n_aux]
+    register_by_register_subtraction(my_circuit, right, xleft)
+    my_circuit.cx(xleft[-1], qubits[-1]) #The most significant qubit is the sign of left-right
+    register_by_register_subtraction_dg(my_circuit, right, xleft)
+    return my_circuit.to_gate()
+
 def register_less_than_register(circ: qiskit.QuantumCircuit, left: List[qiskit.circuit.Qubit], right: List[qiskit.circuit.Qubit], aux: List[qiskit.circuit.Qubit], result: qiskit.circuit.Qubit):
     """Build the quantum circuit of the less-than operation
 
@@ -213,15 +275,12 @@ def register_less_than_register(circ: qiskit.QuantumCircuit, left: List[qiskit.c
     :type left: List[qiskit.circuit.Qubit]
     :param right: right operand
     :type right: List[qiskit.circuit.Qubit]
-    :param aux: ancilla qubit
-    :type aux: qiskit.circuit.Qubit
+    :param aux: ancilla qubits
+    :type aux: List[qiskit.circuit.Qubit]
     :param result: result qubit
     :type result: qiskit.circuit.Qubit
     """
-    xleft = left + aux
-    register_by_register_subtraction(circ, right, xleft)
-    circ.cx(aux, result)
-    register_by_register_subtraction_dg(circ, right, xleft)
+    circ.append(less_than_register_gate(len(left), len(right), len(aux)), left + right + aux + [result])
 
 def register_less_than_register_dg(circ: qiskit.QuantumCircuit, left: List[qiskit.circuit.Qubit], right: List[qiskit.circuit.Qubit], aux: List[qiskit.circuit.Qubit], result: qiskit.circuit.Qubit):
     """Build the inverse quantum circuit of the less-than operation
@@ -232,17 +291,15 @@ def register_less_than_register_dg(circ: qiskit.QuantumCircuit, left: List[qiski
     :type left: List[qiskit.circuit.Qubit]
     :param right: right operand
     :type right: List[qiskit.circuit.Qubit]
-    :param aux: ancilla qubit
-    :type aux: qiskit.circuit.Qubit
+    :param aux: ancilla qubits
+    :type aux: List[qiskit.circuit.Qubit]
     :param result: result qubit
     :type result: qiskit.circuit.Qubit
     """
-    xleft = left + aux
-    register_by_register_addition(circ, right, xleft)
-    circ.cx(aux, result)
-    register_by_register_addition_dg(circ, right, xleft)
+    #The comparison gate computes the sign, copies it and uncomputes the subtraction, so it is its own inverse
+    register_less_than_register(circ, left, right, aux, result)
 
-def register_greater_than_register(circ: qiskit.QuantumCircuit, left: List[qiskit.circuit.Qubit], right: List[qiskit.circuit.Qubit], aux: qiskit.circuit.Qubit, result: qiskit.circuit.Qubit):
+def register_greater_than_register(circ: qiskit.QuantumCircuit, left: List[qiskit.circuit.Qubit], right: List[qiskit.circuit.Qubit], aux: List[qiskit.circuit.Qubit], result: qiskit.circuit.Qubit):
     """Build the quantum circuit of the greater-than operation
 
     :param circ: Target quantum circuit
@@ -251,14 +308,14 @@ def register_greater_than_register(circ: qiskit.QuantumCircuit, left: List[qiski
     :type left: List[qiskit.circuit.Qubit]
     :param right: right operand
     :type right: List[qiskit.circuit.Qubit]
-    :param aux: ancilla qubit
-    :type aux: qiskit.circuit.Qubit
+    :param aux: ancilla qubits
+    :type aux: List[qiskit.circuit.Qubit]
     :param result: result qubit
     :type result: qiskit.circuit.Qubit
     """
     register_less_than_register(circ, right, left, aux, result)
 
-def register_greater_than_register_dg(circ: qiskit.QuantumCircuit, left: List[qiskit.circuit.Qubit], right: List[qiskit.circuit.Qubit], aux: qiskit.circuit.Qubit, result: qiskit.circuit.Qubit):
+def register_greater_than_register_dg(circ: qiskit.QuantumCircuit, left: List[qiskit.circuit.Qubit], right: List[qiskit.circuit.Qubit], aux: List[qiskit.circuit.Qubit], result: qiskit.circuit.Qubit):
     """Build the inverse quantum circuit of the greater-than operation
 
     :param circ: Target quantum circuit
@@ -267,13 +324,71 @@ def register_greater_than_register_dg(circ: qiskit.QuantumCircuit, left: List[qi
     :type left: List[qiskit.circuit.Qubit]
     :param right: right operand
     :type right: List[qiskit.circuit.Qubit]
-    :param aux: ancilla qubit
-    :type aux: qiskit.circuit.Qubit
+    :param aux: ancilla qubits
+    :type aux: List[qiskit.circuit.Qubit]
     :param result: result qubit
     :type result: qiskit.circuit.Qubit
     """
     register_less_than_register_dg(circ, right, left, aux, result)
 
+def inequality_constant_aux_size(n: int, constant: int) -> int:
+    """Returns the number of ancilla qubits of the less-than and greater-than operations between an n-qubit register and a constant.
+    The register is extended until reg-constant and reg-constant-1 fit in two's complement, so the most significant qubit of the extended register is the sign of the comparison.
+
+    :param n: Number of qubits of the register
+    :type n: int
+    :param constant: Const operand
+    :type constant: int
+    :return: Number of ancilla qubits
+    :rtype: int
+    """
+    n_bits = max([n, abs(constant).bit_length()]) + (1 if constant < 0 else 0)
+    return n_bits - n + 1
+
+@lru_cache(maxsize=1024)
+def less_than_constant_gate(n: int, n_aux: int, constant: int) -> qiskit.circuit.Gate:
+    """Returns the gate of the less-than operation with a constant right operand.
+    The gate only depends on the sizes and on the constant, so it is built once and replayed by every comparison with the same parameters.
+    Its qubits are the n qubits of the left operand, followed by the n_aux ancilla qubits and by the result qubit.
+
+    :param n: Number of qubits of the left operand
+    :type n: int
+    :param n_aux: Number of ancilla qubits
+    :type n_aux: int
+    :param constant: right operand
+    :type constant: int
+    :return: Comparison gate
+    :rtype: qiskit.circuit.Gate
+    """
+    my_circuit = qiskit.QuantumCircuit(n + n_aux + 1, name=f'$<{constant}$')
+    xreg = list(range(n + n_aux))
+    my_circuit.append(register_by_constant_addition(n + n_aux, -constant), xreg)
+    my_circuit.cx(n + n_aux - 1, n + n_aux) #The most significant qubit of the extended register is the sign
+    my_circuit.append(register_by_constant_addition_dg(n + n_aux, -constant), xreg)
+    return my_circuit.to_gate()
+
+@lru_cache(maxsize=1024)
+def greater_than_constant_gate(n: int, n_aux: int, constant: int) -> qiskit.circuit.Gate:
+    """Returns the gate of the greater-than operation with a constant right operand, cached like less_than_constant_gate.
+    Its qubits are the n qubits of the left operand, followed by the n_aux ancilla qubits and by the result qubit.
+
+    :param n: Number of qubits of the left operand
+    :type n: int
+    :param n_aux: Number of ancilla qubits
+    :type n_aux: int
+    :param constant: right operand
+    :type constant: int
+    :return: Comparison gate
+    :rtype: qiskit.circuit.Gate
+    """
+    my_circuit = qiskit.QuantumCircuit(n + n_aux + 1, name=f'$>{constant}$')
+    xreg = list(range(n + n_aux))
+    my_circuit.append(register_by_constant_addition(n + n_aux, -constant-1), xreg)
+    my_circuit.cx(n + n_aux - 1, n + n_aux) #The most significant qubit of the extended register is the sign
+    my_circuit.x(n + n_aux)
+    my_circuit.append(register_by_constant_addition_dg(n + n_aux, -constant-1), xreg)
+    return my_circuit.to_gate()
+
 def register_less_than_constant(circ: qiskit.QuantumCircuit, reg: List[qiskit.circuit.Qubit], constant: int, aux: List[qiskit.circuit.Qubit], result: qiskit.circuit.Qubit):
     """Build the quantum circuit of the less-than operation with an constant right operand
 
@@ -288,11 +403,7 @@ def register_less_than_constant(circ: qiskit.QuantumCircuit, reg: List[qiskit.ci
     :param result: result qubit
     :type result: qiskit.circuit.Qubit
     """
-    xreg = reg + aux
-    adder = register_by_constant_addition(len(xreg), -constant)
-    circ.append(adder, xreg)
-    circ.cx(reg[-1], result)
-    circ.append(adder.inverse(), xreg)
+    circ.append(less_than_constant_gate(len(reg), len(aux), constant), reg + aux + [result])
 
 def register_less_than_constant_dg(circ: qiskit.QuantumCircuit, reg: List[qiskit.circuit.Qubit], constant: int, aux: List[qiskit.circuit.Qubit], result: qiskit.circuit.Qubit):
     """Build the inverse quantum circuit of the less-than operation with an constant right operand
@@ -308,11 +419,7 @@ def register_less_than_constant_dg(circ: qiskit.QuantumCircuit, reg: List[qiskit
     :param result: result qubit
     :type result: qiskit.circuit.Qubit
     """
-    xreg = reg + aux
-    adder = register_by_constant_addition(len(xreg), -constant)
-    circ.append(adder.inverse(), xreg)
-    circ.cx(reg[-1], result)
-    circ.append(adder, xreg)
+    register_less_than_constant(circ, reg, constant, aux, result)
 
 def register_greater_than_constant(circ: qiskit.QuantumCircuit, reg: List[qiskit.circuit.Qubit], constant: int, aux: List[qiskit.circuit.Qubit], result: qiskit.circuit.Qubit):
     """Build the quantum circuit of the greater-than operation with an constant right operand
@@ -328,12 +435,7 @@ def register_greater_than_constant(circ: qiskit.QuantumCircuit, reg: List[qiskit
     :param result: result qubit
     :type result: qiskit.circuit.Qubit
     """
-    xreg = reg + aux
-    adder = register_by_constant_addition(len(xreg), -constant-1)
-    circ.append(adder, xreg)
-    circ.cx(reg[-1], result)
-    circ.x(result)
-    circ.append(adder.inverse(), xreg)
+    circ.append(greater_than_constant_gate(len(reg), len(aux), constant), reg + aux + [result])
 
 def register_greater_than_constant_dg(circ: qiskit.QuantumCircuit, reg: List[qiskit.circuit.Qubit], constant: int, aux: List[qiskit.circuit.Qubit], result: qiskit.circuit.Qubit):
     """Build the inverse quantum circuit of the greater-than operation with an constant right operand
@@ -349,28 +451,62 @@ def register_greater_than_constant_dg(circ: qiskit.QuantumCircuit, reg: List[qis
     :param result: result qubit
     :type result: qiskit.circuit.Qubit
     """
-    xreg = reg + aux
-    adder = register_by_constant_addition(len(xreg), -constant-1)
-    circ.append(adder.inverse(), xreg)
-    circ.x(result)
-    circ.cx(reg[-1], result)
-    circ.append(adder, xreg)
+    register_greater_than_constant(circ, reg, constant, aux, result)
     
-def register_equal_register(circ: qiskit.QuantumCircuit, left: List[qiskit.circuit.Qubit], right: List[qiskit.circuit.Qubit], aux: List[qiskit.circuit.Qubit], result: qiskit.circuit.Qubit):
-    """Build a quantum circuit to the Equal operation between two registers
+def mcx_n_ancillas(n_controls: int) -> int:
+    """Returns the number of clean ancilla qubits used by mcx_with_ancillas to synthesize a v-chain MCX with n_controls control qubits.
+
+    :param n_controls: Number of control qubits
+    :type n_controls: int
+    :return: Number of ancilla qubits
+    :rtype: int
+    """
+    return max([n_controls - 2, 0])
+
+def mcx_with_ancillas(circ: qiskit.QuantumCircuit, controls: List[int], target: int, ancillas: List[int]):
+    """Append an MCX gate to a circuit.
+    If there are enough clean ancilla qubits (see mcx_n_ancillas), the MCX is synthesized as a v-chain of Toffoli gates, that has O(n) CNOTs, instead of the O(n^2) synthesis without ancillas.
+    The ancilla qubits are returned to the zero state.
 
     :param circ: Target quantum circuit
     :type circ: qiskit.QuantumCircuit
-    :param left: left operand
-    :type left: List[qiskit.circuit.Qubit]
-    :param right: right operand
-    :type right: List[qiskit.circuit.Qubit]
-    :param aux: ancilla qubits
-    :type aux: List[qiskit.circuit.Qubit]
-    :param result: result qubit
-    :type result: qiskit.circuit.Qubit
+    :param controls: Control qubits
+    :type controls: List[int]
+    :param target: Target qubit
+    :type target: int
+    :param ancillas: Clean ancilla qubits
+    :type ancillas: List[int]
+    """
+    n_ancillas = mcx_n_ancillas(len(controls))
+    if n_ancillas > 0 and len(ancillas) >= n_ancillas:
+        circ.mcx(controls, target, ancilla_qubits=ancillas[:n_ancillas], mode='v-chain')
+    else:
+        circ.mcx(controls, target)
+
+@lru_cache(maxsize=1024)
+def equal_register_gate(n_left: int, n_right: int, n_aux: int) -> qiskit.circuit.Gate:
+    """Returns the gate of the Equal operation between two registers.
+    The shorter operand is extended by the first ancilla qubits, the left operand is XORed into the right one with a CX ladder, and the result is flipped if every bit of the XOR is zero.
+    The remaining ancilla qubits are used as the workspace of the MCX (see mcx_with_ancillas).
+    The gate only depends on the sizes, so the ladders and the MCX are built once and the gate is replayed by every comparison with the same sizes.
+    Its qubits are the n_left qubits of the left operand, followed by the n_right qubits of the right operand, the n_aux ancilla qubits and the result qubit.
+
+    :param n_left: Number of qubits of the left operand
+    :type n_left: int
+    :param n_right: Number of qubits of the right operand
+    :type n_right: int
+    :param n_aux: Number of ancilla qubits
+    :type n_aux: int
+    :return: Comparison gate
+    :rtype: qiskit.circuit.Gate
     """
-    if len(left) >= len(right):
+    my_circuit = qiskit.QuantumCircuit(n_left + n_right + n_aux + 1, name='$=$')
+    left = list(range(n_left))
+    right = list(range(n_left, n_left + n_right))
+    n_ext = abs(n_left - n_right)
+    aux = list(range(n_left + n_right, n_left + n_right + n_ext))
+    chain = list(range(n_left + n_right + n_ext, n_left + n_right + n_aux))
+    if n_left >= n_right:
         xleft = left
         xright = right + aux
     else:
@@ -379,12 +515,31 @@ def register_equal_register(circ: qiskit.QuantumCircuit, left: List[qiskit.circu
     assert len(xleft) == len(xright)
 
     for i in range(len(xleft)):
-        circ.cx(xleft[i], xright[i])
+        my_circuit.cx(xleft[i], xright[i])
+    my_circuit.x(xright) #The XOR is all zeros if the operands are equal, so it is flipped to be matched by the MCX
 
-    circ.mcx(xright, result)
-    
+    mcx_with_ancillas(my_circuit, xright, n_left + n_right + n_aux, chain)
+
+    my_circuit.x(xright)
     for i in range(len(xleft))[::-1]:
-        circ.cx(xleft[i], xright[i])
+        my_circuit.cx(xleft[i], xright[i])
+    return my_circuit.to_gate()
+
+def register_equal_register(circ: qiskit.QuantumCircuit, left: List[qiskit.circuit.Qubit], right: List[qiskit.circuit.Qubit], aux: List[qiskit.circuit.Qubit], result: qiskit.circuit.Qubit):
+    """Build a quantum circuit to the Equal operation between two registers
+
+    :param circ: Target quantum circuit
+    :type circ: qiskit.QuantumCircuit
+    :param left: left operand
+    :type left: List[qiskit.circuit.Qubit]
+    :param right: right operand
+    :type right: List[qiskit.circuit.Qubit]
+    :param aux: ancilla qubits
+    :type aux: List[qiskit.circuit.Qubit]
+    :param result: result qubit
+    :type result: qiskit.circuit.Qubit
+    """
+    circ.append(equal_register_gate(len(left), len(right), len(aux)), left + right + aux + [result])
 
 def register_equal_register_dg(circ: qiskit.QuantumCircuit, left: List[qiskit.circuit.Qubit], right: List[qiskit.circuit.Qubit], aux: List[qiskit.circuit.Qubit], result: qiskit.circuit.Qubit):
     """Build an inverse quantum circuit to the Equal operation between two registers
@@ -402,6 +557,45 @@ def register_equal_register_dg(circ: qiskit.QuantumCircuit, left: List[qiskit.ci
     """
     register_equal_register(circ, left, right, aux, result)
 
+def equal_constant_extension(n: int, constant: int) -> int:
+    """Returns the number of ancilla qubits that extend an n-qubit register so that it has as many bits as the constant of an Equal operation.
+
+    :param n: Number of qubits of the register
+    :type n: int
+    :param constant: Const operand
+    :type constant: int
+    :return: Number of extension qubits
+    :rtype: int
+    """
+    return max([constant.bit_length() - n, 0])
+
+@lru_cache(maxsize=1024)
+def equal_constant_gate(n: int, n_aux: int, constant: int) -> qiskit.circuit.Gate:
+    """Returns the gate of the Equal operation between a register and a constant, cached like less_than_constant_gate.
+    The X mask of the zero bits of the constant and the MCX are built once, and each comparison appends a single instruction.
+    The register is extended by the first ancilla qubits until the constant fits in it, and the remaining ancilla qubits are used as the workspace of the MCX (see mcx_with_ancillas).
+    Its qubits are the n qubits of the register, followed by the n_aux ancilla qubits and by the result qubit.
+
+    :param n: Number of qubits of the register
+    :type n: int
+    :param n_aux: Number of ancilla qubits
+    :type n_aux: int
+    :param constant: Const operand
+    :type constant: int
+    :return: Comparison gate
+    :rtype: qiskit.circuit.Gate
+    """
+    my_circuit = qiskit.QuantumCircuit(n + n_aux + 1, name=f'$={constant}$')
+    n_ext = equal_constant_extension(n, constant)
+    bconst = natural_to_binary(constant, n + n_ext)
+    zeros = [i for i in range(n + n_ext) if not bconst[i]] #Qubits that must be flipped so that the constant is matched by ones
+    if zeros:
+        my_circuit.x(zeros)
+    mcx_with_ancillas(my_circuit, list(range(n + n_ext)), n + n_aux, list(range(n + n_ext, n + n_aux)))
+    if zeros:
+        my_circuit.x(zeros)
+    return my_circuit.to_gate()
+
 def register_equal_constant(circ: qiskit.QuantumCircuit, reg: List[qiskit.circuit.Qubit], constant: int, aux: List[qiskit.circuit.Qubit], result: qiskit.circuit.Qubit):
     """Build a quantum circuit to the Equal operation between a register and a constant
 
@@ -416,15 +610,7 @@ def register_equal_constant(circ: qiskit.QuantumCircuit, reg: List[qiskit.circui
     :param result: Result qubit
     :type result: qiskit.circuit.Qubit
     """
-    xreg = reg + aux
-    bconst = natural_to_binary(constant, len(reg)+len(aux))
-    for i in range(len(bconst)):
-        if not bconst[i]:
-            circ.x(xreg[i])
-    circ.mcx(reg+aux, result)
-    for i in range(len(bconst)):
-        if not bconst[i]:
-            circ.x(xreg[i])
+    circ.append(equal_constant_gate(len(reg), len(aux), constant), reg + aux + [result])
 
 def register_equal_constant_dg(circ: qiskit.QuantumCircuit, reg: List[qiskit.circuit.Qubit], constant: int, aux: List[qiskit.circuit.Qubit], result: qiskit.circuit.Qubit):
     """Build an inverse quantum circuit to the Equal operation between a register and a constant
@@ -509,3 +695,42 @@ def register_not_equal_constant_dg(circ: qiskit.QuantumCircuit, reg: List[qiskit
     """
     circ.x(result)
     register_equal_constant_dg(circ, reg, constant, aux, result)
+
+# --- State preparation circuits ---
+
+def set_superposition_gate(values: Iterable[int], size: int) -> Optional[qiskit.circuit.Gate]:
+    """Returns a gate that prepares the uniform superposition of a set of values in a register initialized with zeros, without a dense statevector.
+    The values are split by their bits from the most significant to the least significant, like a binary trie.
+    At each level of the trie, a RY rotation divides the amplitude between the values with 0 and 1 in the current bit.
+    It is only possible with uncontrolled rotations if every node of a level needs the same one, which is the case of sets such as single values or full ranges.
+
+    :param values: Superposed values. Must be distinct naturals less than 2**size.
+    :type values: Iterable[int]
+    :param size: Register's size
+    :type size: int
+    :return: State preparation gate, or None if a level of the trie needs controlled rotations
+    :rtype: Optional[qiskit.circuit.Gate]
+    """
+    my_circuit = qiskit.QuantumCircuit(size, name='init')
+    nodes = [list(values)] #Values of each node of the current level of the trie
+
+    for q in range(size-1, -1, -1):
+        children = []
+        fractions = set() #Fractions of the values of each node with 0 in qubit q
+        for node_values in nodes:
+            zeros = [v for v in node_values if not v >> q & 1]
+            ones = [v for v in node_values if v >> q & 1]
+            fractions.add(len(zeros)/len(node_values))
+            children += [child for child in (zeros, ones) if child]
+
+        if len(fractions) > 1: #The nodes need different rotations, which would have to be controlled by the qubits above q
+            return None
+        fraction = fractions.pop()
+        if fraction == 0: #All the values have 1 in qubit q
+            my_circuit.x(q)
+        elif fraction < 1:
+            my_circuit.ry(2*acos(sqrt(fraction)), q)
+
+        nodes = children
+
+    return my_circuit.to_gate()
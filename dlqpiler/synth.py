@@ -4,9 +4,11 @@ import qiskit
 from qiskit.providers.aer import AerSimulator
 import pandas as pd
 from qiskit.circuit.library.data_preparation.state_preparation import StatePreparation
-from dlqpiler.ast import FullCode, RegisterExpressionDefinition, RegisterSetDefinition
+from dlqpiler.ast import FullCode
 from dlqpiler import utils
+from dlqpiler import qunits
 from typing import *
+from collections import deque
 
 def reg_init_gate(values: Set[int], size: int) -> qiskit.circuit.Gate:
     """Returns the quantum initialization gate for a set of values
@@ -15,13 +17,17 @@ def reg_init_gate(values: Set[int], size: int) -> qiskit.circuit.Gate:
     :type values: Set[int]
     :param size: Register size
     :type size: int
-    :return: StatePreparation gate
+    :return: State preparation gate
     :rtype: qiskit.circuit.Gate
     """
-    if utils.is_none(values) or len(values)==0:
+    if values is None or len(values)==0:
         qc = qiskit.QuantumCircuit(size)
         return qc.to_gate()
     else:
+        #Sets such as single values or full ranges are prepared by uncontrolled single-qubit gates, without a dense statevector of 2**size amplitudes
+        sparse_gate = qunits.set_superposition_gate(values, size)
+        if sparse_gate is not None:
+            return sparse_gate
         return StatePreparation(utils.set_to_statevector(values, size))
 
 def organize_qiskit_result(result_counts: Dict[str, int], registers_names: List[str], test_function: Callable[[dict], str] = None) -> pd.DataFrame:
@@ -47,7 +53,7 @@ def organize_qiskit_result(result_counts: Dict[str, int], registers_names: List[
         #Convert bit-strings to naturals, integers or booleans
         reg_data_list = []
         for i in range(len(reg_bit_string)):
-            reg_data_list.append(utils.binary_to_natural([True if c=='1' else False for c in reg_bit_string[i]][::-1]))
+            reg_data_list.append(int(reg_bit_string[i], 2)) #Qiskit bit-strings have the most significant bit first
             
         #Append results to the output dictionary
         for i in range(len(reg_bit_string)):
@@ -92,7 +98,12 @@ class QuantumEvaluator():
 
         # --- Ancilla qubits ---
         self.ancilla_qubits = dict() # id-to-object mapping
-        self.clean_ancillas = []
+        self.clean_ancillas = deque() #FIFO pool of released ancillas, reused before the circuit grows
+        self.clean_ancilla_ids = set() #ids of the qubits in clean_ancillas
+        self.live_results = dict() #structural key -> [node that built the result, number of users], for common subexpression elimination
+
+        # --- Qubit lists of the main registers, shared by all the identifiers with the same label ---
+        self.qubit_lists = dict()
 
     def get_qiskit_register(self, label: str) -> qiskit.QuantumRegister:
         """Returns the respective circuit register
@@ -107,6 +118,23 @@ class QuantumEvaluator():
                 return reg
         return None
     
+    def get_qubit_list(self, label: str) -> List[qiskit.circuit.Qubit]:
+        """Returns the qubits of the respective register as a list. The list is cached and must be treated as read-only.
+
+        :param label: Register's label (name)
+        :type label: str
+        :return: List of qubits, or None if the register does not exist
+        :rtype: List[qiskit.circuit.Qubit]
+        """
+        qubits = self.qubit_lists.get(label)
+        if qubits is None:
+            reg = self.get_qiskit_register(label)
+            if reg is None:
+                return None
+            qubits = list(reg)
+            self.qubit_lists[label] = qubits
+        return qubits
+
     def get_register_size(self, label: str) -> int:
         """Returns the respective register's size
 
@@ -128,8 +156,8 @@ class QuantumEvaluator():
         """
         if len(self.clean_ancillas) > 0: #If there are available clean ancillas
             #Get an existent clean ancilla
-            qubit = self.clean_ancillas[0]
-            del self.clean_ancillas[0]
+            qubit = self.clean_ancillas.popleft()
+            self.clean_ancilla_ids.remove(id(qubit))
         else:
             reg = qiskit.QuantumRegister(1)
             qubit = reg[0]
@@ -137,6 +165,74 @@ class QuantumEvaluator():
             self.ancilla_qubits[id(qubit)] = qubit
         return qubit
         
+    def alloc_ancillas(self, n: int) -> List[qiskit.circuit.AncillaQubit]:
+        """Allocate n ancilla qubits at once. Clean ancillas are reused first and the missing ones are added to the circuit in a single register.
+
+        :param n: Number of qubits
+        :type n: int
+        :return: List of qubit objects
+        :rtype: List[qiskit.circuit.AncillaQubit]
+        """
+        n_reused = min(n, len(self.clean_ancillas))
+        qubits = [self.clean_ancillas.popleft() for i in range(n_reused)]
+        for qubit in qubits:
+            self.clean_ancilla_ids.remove(id(qubit))
+        if n > n_reused:
+            reg = qiskit.QuantumRegister(n - n_reused)
+            self.quantum_circuit.add_register(reg)
+            for qubit in reg:
+                self.ancilla_qubits[id(qubit)] = qubit
+                qubits.append(qubit)
+        return qubits
+
+    def idle_ancillas(self, n: int) -> List[qiskit.circuit.AncillaQubit]:
+        """Returns n clean ancillas of the pool without allocating them, or an empty list if the pool has less than n.
+        The qubits stay in the pool, so they can only be used as clean workspace by a single instruction that returns them to |0>. The circuit never grows.
+
+        :param n: Number of qubits
+        :type n: int
+        :return: List of qubit objects
+        :rtype: List[qiskit.circuit.AncillaQubit]
+        """
+        if n > len(self.clean_ancillas):
+            return []
+        return [self.clean_ancillas[i] for i in range(n)]
+
+    def reserve_ancillas(self, n: int):
+        """Grow the pool of clean ancillas to at least n qubits, adding the missing ones to the circuit in a single register
+
+        :param n: Number of qubits
+        :type n: int
+        """
+        n_missing = n - len(self.clean_ancillas)
+        if n_missing > 0:
+            reg = qiskit.QuantumRegister(n_missing)
+            self.quantum_circuit.add_register(reg)
+            for qubit in reg:
+                self.ancilla_qubits[id(qubit)] = qubit
+                self.clean_ancillas.append(qubit)
+                self.clean_ancilla_ids.add(id(qubit))
+
+    def count_peak_ancillas(self) -> int:
+        """Returns the peak number of ancillas in use while the evaluator is built and reverted, from a lifetime analysis of the traced programs of all the expression definitions. Must be called after pre_build.
+        Every Grover iteration builds and reverts the evaluator in the same way, so reserving this many ancillas is enough for the entire circuit.
+
+        :return: Number of ancillas
+        :rtype: int
+        """
+        live_results = dict()
+        owners = dict()
+        n_live = 0
+        peak = 0
+        for regdef in self.code.expr_defs:
+            n, regdef_peak = regdef.expr.count_ancillas(self, regdef.program, live_results, owners, n_live)
+            n_live += n
+            peak = max(peak, regdef_peak)
+        for regdef in self.code.expr_defs[::-1]:
+            n_live, regdef_peak = regdef.expr.count_reverse_ancillas(self, regdef.program, live_results, owners, n_live)
+            peak = max(peak, regdef_peak)
+        return peak
+
     def free_ancilla(self, qubit: qiskit.circuit.AncillaQubit):
         """Release a clean ancilla qubit
 
@@ -144,36 +240,46 @@ class QuantumEvaluator():
         :type qubit: qiskit.circuit.AncillaQubit
         """
         assert id(qubit) in self.ancilla_qubits.keys(), f'The ancilla qubit {id(qubit)} does not belong to the circuit'
-        assert qubit not in self.clean_ancillas, f'The ancilla qubit {id(qubit)} is not in use'
+        assert id(qubit) not in self.clean_ancilla_ids, f'The ancilla qubit {id(qubit)} is not in use'
         self.clean_ancillas.append(qubit)
+        self.clean_ancilla_ids.add(id(qubit))
+
+    def free_ancillas(self, qubits: List[qiskit.circuit.AncillaQubit]):
+        """Release a list of clean ancilla qubits
+
+        :param qubits: Ancillas to release
+        :type qubits: List[qiskit.circuit.AncillaQubit]
+        """
+        #Released in bulk, with the same checks as free_ancilla
+        ids = [id(qubit) for qubit in qubits]
+        assert all(qid in self.ancilla_qubits for qid in ids), 'An ancilla qubit does not belong to the circuit'
+        assert self.clean_ancilla_ids.isdisjoint(ids) and len(set(ids)) == len(ids), 'An ancilla qubit is not in use'
+        self.clean_ancillas.extend(qubits)
+        self.clean_ancilla_ids.update(ids)
     
     def initialize_registers(self):
         """Append the initialization gates to the quantum circuit
         """
-        for regdef in self.code.regdefseq:
-            if isinstance(regdef, RegisterSetDefinition):
-                self.quantum_circuit.append(reg_init_gate(regdef.values, regdef.n), self.get_qiskit_register(regdef.name))
+        for regdef in self.code.set_defs:
+            self.quantum_circuit.append(reg_init_gate(regdef.values, regdef.n), self.get_qiskit_register(regdef.name))
             
     def revert_registers_initialization(self):
         """Append the inverce initialization gates to the quantum circuit
         """
-        for regdef in self.code.regdefseq[::-1]:
-            if isinstance(regdef, RegisterSetDefinition):
-                self.quantum_circuit.append(reg_init_gate(regdef.values, regdef.n).inverse(), self.get_qiskit_register(regdef.name))
+        for regdef in self.code.set_defs[::-1]:
+            self.quantum_circuit.append(reg_init_gate(regdef.values, regdef.n).inverse(), self.get_qiskit_register(regdef.name))
                 
     def build_evaluator(self):
         """Build a quantum circuit to evaluate the entire code
         """
-        for regdef in self.code.regdefseq:
-            if isinstance(regdef, RegisterExpressionDefinition):
-                regdef.build(self)
+        for regdef in self.code.expr_defs:
+            regdef.build(self)
 
     def revert_evaluator(self):
         """Build the inverse evaluation quantum circuit
         """
-        for regdef in self.code.regdefseq[::-1]:
-            if isinstance(regdef, RegisterExpressionDefinition):
-                regdef.reverse(self)
+        for regdef in self.code.expr_defs[::-1]:
+            regdef.reverse(self)
             
     def append_measurements(self):
         """Append measurement gates
@@ -184,8 +290,9 @@ class QuantumEvaluator():
             cr = self.main_classical_registers_list[i][2]
             self.quantum_circuit.measure(qr, cr)
 
-    def simulate(self, simulator: AerSimulator, shots=1024, test_function: Callable[[dict], str] = None) -> pd.DataFrame:
+    def simulate(self, simulator: AerSimulator, shots=1024, test_function: Callable[[dict], str] = None, optimization_level: int = 1) -> pd.DataFrame:
         """Execute the circuit using a qiskit simulator.
+        The circuit is transpiled for the simulator and only the measurement counts are requested, so the simulator samples the measured registers instead of returning its full state.
 
         :param simulator: Qiskit simulator.
         :type simulator: AerSimulator
@@ -193,10 +300,13 @@ class QuantumEvaluator():
         :type shots: int, optional
         :param test_function: A function that receives a dict with a value for each register and return a status about it.  Default to None.
         :type test_function: Callable[[dict], str], optional
+        :param optimization_level: Optimization level of the qiskit transpiler, defaults to 1
+        :type optimization_level: int, optional
         :return: DataFrame generated by the organize_qiskit_result function.
         :rtype: pd.DataFrame
         """
-        result_counts = qiskit.execute(self.quantum_circuit, simulator, shots=shots).result().get_counts()
+        circuit = qiskit.transpile(self.quantum_circuit, simulator, optimization_level=optimization_level)
+        result_counts = simulator.run(circuit, shots=shots).result().get_counts()
         return organize_qiskit_result(
                 result_counts,
                 registers_names=[reg[0] for reg in self.main_registers_list], 
@@ -230,8 +340,10 @@ class QuantumEvaluator():
         self.quantum_circuit.h(self.phase_qubit)
         self.initialize_registers()
         qubits = self.get_qubits()
+        self.reserve_ancillas(self.count_peak_ancillas()) #Added after the snapshot above, like the ancillas that the first build would allocate
 
-        for i in range(iterations):
+        if iterations > 0:
+            start = len(self.quantum_circuit.data)
             self.build_evaluator()
             self.quantum_circuit.barrier()
             self.quantum_circuit.cz(self.target_qubit, self.phase_qubit)
@@ -248,6 +360,12 @@ class QuantumEvaluator():
             self.quantum_circuit.x(qubits)
             self.initialize_registers()
             self.quantum_circuit.barrier()
+
+            #Every iteration leaves the ancillas clean, so the instructions of the first one are replayed instead of synthesizing the same iteration again
+            grover_step = self.quantum_circuit.data[start:]
+            for i in range(iterations - 1):
+                for instruction in grover_step:
+                    self.quantum_circuit.append(instruction.operation, instruction.qubits, instruction.clbits)
         
 
         self.build_evaluator()
@@ -255,9 +373,9 @@ class QuantumEvaluator():
     def build_all(self):
         """Build the entire quantum circuit
         """
-        for regdef in self.code.regdefseq:
-            if isinstance(regdef, RegisterExpressionDefinition):
-                regdef.pre_build(self)
+        for regdef in self.code.expr_defs:
+            regdef.pre_build(self)
+        self.code.clear_dict_cache() #pre_build rewrites the expression trees
                 
         self.build_grover_search(self.code.terminator.it)
         self.append_measurements()
\ No newline at end of file
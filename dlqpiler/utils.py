@@ -2,6 +2,7 @@
 
 from typing import *
 from math import sqrt
+import numpy as np
 
 def is_none(obj) -> bool:
     """
@@ -22,8 +23,8 @@ def natural_to_binary(x: int, n: int) -> List[bool]:
     :rtype: List[bool]
     """
     assert n > 0
-    x = x % 2**n
-    return [bool((x//2**i)%2) for i in range(n)]
+    #Shifts and masks replace the big-int divisions and powers. The mask also gives the n-bit two's complement of negative numbers, like x % 2**n.
+    return [bool(x >> i & 1) for i in range(n)]
 
 def binary_to_natural(x: List[bool]) -> int:
     """Returns x as a natural number (including zero).
@@ -33,26 +34,25 @@ def binary_to_natural(x: List[bool]) -> int:
     :rtype: int
     """
     n = len(x)
-    return sum([(2**i)*int(x[i]) for i in range(n)])
+    return sum(1 << i for i in range(n) if x[i])
 
-def set_to_statevector(values: Set[int], size: int) -> List[float]:
+def set_to_statevector(values: Set[int], size: int) -> np.ndarray:
     """Return the statevector of a register initialized with a set of positive integer values.
 
     :param values: Superposed values
     :type values: Set[int]
     :param size: Register's size
     :type size: int
-    :return: Statevector as a list of float values
-    :rtype: List[float]
+    :return: Statevector as an array of float values
+    :rtype: np.ndarray
     """
-    assert all([isinstance(v, int) for v in values])
-    assert all([v >= 0 for v in values])
-    assert all([v < 2**size for v in values])
+    assert all(isinstance(v, int) for v in values)
+    assert all(v >= 0 for v in values)
+    assert all(v < 2**size for v in values)
     assert isinstance(size, int) and size > 0
 
-    psi = [0 for i in range(2**size)]
-               
-    for v in values:
-        psi[v] = 1/sqrt(len(values))
+    #The amplitudes are written by a single indexed assignment into a zeroed array, instead of a Python loop over 2**size elements
+    psi = np.zeros(1 << size, dtype=np.float64)
+    psi[np.fromiter(values, dtype=np.int64, count=len(values))] = 1/sqrt(len(values))
 
     return psi
\ No newline at end of file
@@ -0,0 +1,19 @@
+#Filipe Chagas, 2023
+
+import dlqpiler.lexer
+from dlqpiler.lexer import lexer
+
+def test_lextab_is_up_to_date(tmp_path):
+    #In optimize mode, PLY loads dlqpiler/_lextab.py without checking it against the rules, so the committed table must be regenerated whenever a t_ rule or a reserved word changes
+    #The table is built from the namespace of the lexer module, in definition order, like the import of dlqpiler.lexer does. With module=, PLY would collect the rules in alphabetical order instead.
+    eval("lex.lex(optimize=1, lextab='_lextab_check', outputdir=outputdir)", dict(vars(dlqpiler.lexer)), {'outputdir': str(tmp_path)})
+    generated = (tmp_path / '_lextab_check.py').read_text().splitlines()
+    with open(dlqpiler.lexer.__file__.replace('lexer.py', '_lextab.py')) as f:
+        committed = f.read().splitlines()
+    #The first line is a comment with the name of the module
+    assert generated[1:] == committed[1:]
+
+def test_tokens():
+    lexer.input('a[2] := b*3 != 1 and not c')
+    tokens = [(tok.type, tok.value) for tok in iter(lexer.token, None)]
+    assert tokens == [('ID', 'a'), ('LBRACKET', '['), ('NUMBER', 2), ('RBRACKET', ']'), ('ASSIGN', ':='), ('ID', 'b'), ('MUL', '*'), ('NUMBER', 3), ('NEQ', '!='), ('NUMBER', 1), ('AND', 'and'), ('NOT', 'not'), ('ID', 'c')]
@@ -0,0 +1,61 @@
+#Filipe Chagas, 2023
+
+import pytest
+from qiskit.providers.aer import AerSimulator
+from dlqpiler import ast, main
+from dlqpiler.errors import ParsingError
+from dlqpiler.parser import parse
+
+def parse_expression(expr: str) -> object:
+    return parse(f'a[2] in {{1, 2}};\nb[2] in {{0, 3}};\nc[2] in {{1}};\nr[4] := {expr};\namplify r 1 times').regdefseq[3].expr
+
+def simulate(code: str) -> set:
+    #The programs are deterministic for each value of the set registers, so every sampled row is one of the expected ones
+    result = main.build_qe(code).simulate(AerSimulator(), shots=100)
+    return set(result.drop(columns='$freq').itertuples(index=False, name=None))
+
+def test_chains_are_flattened():
+    summation = parse_expression('a + b - c + a - 3')
+    assert type(summation) is ast.Summation
+    assert [op.label for op in summation.operands[:-1]] == ['a', 'b', 'c', 'a']
+    assert list(summation.signals) == [True, True, False, True, False]
+    assert summation.operands[-1] == 3
+    product = parse_expression('a * b * 2 * c')
+    assert type(product) is ast.Product
+    assert [op.label for op in product.operands[:-1]] == ['a', 'b', 'c']
+    assert product.operands[-1] == 2
+    assert len(parse_expression('a = 1 or b = 1 or c = 1').operands) == 3
+    assert len(parse_expression('a = 1 and b = 1 and c = 1').operands) == 3
+
+def test_merge_does_not_modify_its_operands():
+    a, b, c = (ast.Identifier.intern(1, label) for label in 'abc')
+    summation = ast.Summation.merge_add(1, a, b)
+    assert ast.Summation.merge_sub(1, summation, c) is not summation
+    assert len(summation.operands) == 2
+    product = ast.Product.merge(1, a, b)
+    assert ast.Product.merge(1, product, c) is not product
+    assert len(product.operands) == 2
+    for cls in (ast.And, ast.Or):
+        node = cls.merge(1, a, b)
+        assert cls.merge(1, node, c) is not node
+        assert len(node.operands) == 2
+
+#Constant folding reduces these expressions to an identifier or a constant, which is still assigned to the register
+@pytest.mark.parametrize('expr, value', [('a*1', lambda a: a), ('a*0', lambda a: 0), ('a+0', lambda a: a), ('a-0', lambda a: a), ('--a', lambda a: a), ('a^1', lambda a: a), ('a^0', lambda a: 1)])
+def test_folded_definitions(expr, value):
+    assert simulate(f'a[2] in {{1, 2}};\ny[3] := {expr};\namplify y 0 times') == {(a, value(a)) for a in (1, 2)}
+
+#A grouped summation keeps its own register, which is one qubit wider than its operands, so 3 + (3 + 3) is 9 and not 9 modulo 8
+@pytest.mark.parametrize('expr', ['a + (b + c)', '(a + b) + c'])
+def test_grouped_summation_is_not_flattened(expr):
+    assert simulate(f'a[2] in {{3}};\nb[2] in {{3}};\nc[2] in {{3}};\ny[1] := {expr} = 1;\namplify y 0 times') == {(3, 3, 3, 0)}
+
+#The two occurrences of the register are different nodes, because they are on different lines
+def test_negated_register_used_twice_across_lines():
+    assert simulate('a[1] in {0, 1};\ny[1] := not a and\na;\namplify y 0 times') == {(0, 0), (1, 0)}
+    assert simulate('a[1] in {0, 1};\ny[1] := not a or\na;\namplify y 0 times') == {(0, 1), (1, 1)}
+
+@pytest.mark.parametrize('values', ['5', '-1', '0, 4'])
+def test_set_values_out_of_range(values):
+    with pytest.raises(ParsingError):
+        parse(f'a[2] in {{{values}}};\namplify a 0 times')
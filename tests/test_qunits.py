@@ -0,0 +1,89 @@
+#Filipe Chagas, 2023
+
+import itertools
+import numpy as np
+import pytest
+import qiskit
+from qiskit.quantum_info import Operator, Statevector
+from dlqpiler import qunits
+
+WIDTHS = [1, 2, 3]
+CONSTANTS = range(-5, 13)
+
+def apply_to_basis(matrix: np.ndarray, x: int) -> int:
+    """Return the basis state that the unitary matrix maps the basis state x to, failing if the output is not a basis state"""
+    column = matrix[:, x]
+    y = int(np.argmax(np.abs(column)))
+    assert np.isclose(abs(column[y]), 1)
+    return y
+
+def check_predicate(gate, inputs, predicate):
+    """Check that the gate XORs predicate(*inputs) into its last qubit and returns every ancilla qubit to |0>.
+    The input qubits come first, followed by the ancilla qubits and by the result qubit."""
+    n_qubits = gate.num_qubits
+    matrix = Operator(gate).data
+    for x, args in inputs:
+        for r in (0, 1):
+            state = x | r << (n_qubits - 1)
+            expected = x | (r ^ int(predicate(*args))) << (n_qubits - 1)
+            assert apply_to_basis(matrix, state) == expected, (args, r)
+
+@pytest.mark.parametrize('n', WIDTHS)
+@pytest.mark.parametrize('constant', CONSTANTS)
+def test_less_than_constant_gate(n, constant):
+    gate = qunits.less_than_constant_gate(n, qunits.inequality_constant_aux_size(n, constant), constant)
+    check_predicate(gate, ((a, (a,)) for a in range(2**n)), lambda a: a < constant)
+
+@pytest.mark.parametrize('n', WIDTHS)
+@pytest.mark.parametrize('constant', CONSTANTS)
+def test_greater_than_constant_gate(n, constant):
+    gate = qunits.greater_than_constant_gate(n, qunits.inequality_constant_aux_size(n, constant), constant)
+    check_predicate(gate, ((a, (a,)) for a in range(2**n)), lambda a: a > constant)
+
+@pytest.mark.parametrize('n_left, n_right', list(itertools.product(WIDTHS, WIDTHS)))
+def test_less_than_register_gate(n_left, n_right):
+    #The left operand is extended until it is as wide as the right one, plus the sign qubit
+    gate = qunits.less_than_register_gate(n_left, n_right, max([n_right - n_left, 0]) + 1)
+    inputs = ((a | b << n_left, (a, b)) for a in range(2**n_left) for b in range(2**n_right))
+    check_predicate(gate, inputs, lambda a, b: a < b)
+
+@pytest.mark.parametrize('n_left, n_right', list(itertools.product(WIDTHS, WIDTHS)))
+@pytest.mark.parametrize('circuit, inverse_circuit', [(qunits.register_less_than_register, qunits.register_less_than_register_dg), (qunits.register_greater_than_register, qunits.register_greater_than_register_dg)])
+def test_register_comparison_inverse(n_left, n_right, circuit, inverse_circuit):
+    n_aux = abs(n_left - n_right) + 1
+    circ = qiskit.QuantumCircuit(n_left + n_right + n_aux + 1)
+    qubits = circ.qubits
+    args = (qubits[:n_left], qubits[n_left:n_left + n_right], qubits[n_left + n_right:-1], qubits[-1])
+    circuit(circ, *args)
+    inverse_circuit(circ, *args)
+    assert Operator(circ).equiv(Operator(qiskit.QuantumCircuit(circ.num_qubits)))
+
+@pytest.mark.parametrize('n_left, n_right', list(itertools.product(WIDTHS, WIDTHS)))
+@pytest.mark.parametrize('v_chain', [False, True])
+def test_equal_register_gate(n_left, n_right, v_chain):
+    #The first ancilla qubits extend the shorter operand, and the remaining ones are the workspace of the v-chain MCX
+    n_aux = abs(n_left - n_right) + (qunits.mcx_n_ancillas(max([n_left, n_right])) if v_chain else 0)
+    gate = qunits.equal_register_gate(n_left, n_right, n_aux)
+    inputs = ((a | b << n_left, (a, b)) for a in range(2**n_left) for b in range(2**n_right))
+    check_predicate(gate, inputs, lambda a, b: a == b)
+
+@pytest.mark.parametrize('n', WIDTHS)
+@pytest.mark.parametrize('constant', range(0, 13))
+@pytest.mark.parametrize('v_chain', [False, True])
+def test_equal_constant_gate(n, constant, v_chain):
+    n_ext = qunits.equal_constant_extension(n, constant)
+    n_aux = n_ext + (qunits.mcx_n_ancillas(n + n_ext) if v_chain else 0)
+    gate = qunits.equal_constant_gate(n, n_aux, constant)
+    check_predicate(gate, ((a, (a,)) for a in range(2**n)), lambda a: a == constant)
+
+@pytest.mark.parametrize('values, size', [({0}, 1), ({1}, 1), ({0, 1}, 1), ({5}, 3), ({0, 1, 2, 3}, 2), ({0, 2}, 2), ({4, 5, 6, 7}, 3), ({1, 3, 5, 7}, 3)])
+def test_set_superposition_gate(values, size):
+    gate = qunits.set_superposition_gate(values, size)
+    expected = np.zeros(2**size)
+    expected[list(values)] = 1/np.sqrt(len(values))
+    assert Statevector(gate).equiv(Statevector(expected))
+
+@pytest.mark.parametrize('values, size', [({1, 2}, 2), ({0, 1, 2}, 2), ({0, 3, 5}, 3)])
+def test_set_superposition_gate_needs_controls(values, size):
+    #These sets need rotations controlled by the upper qubits, so the caller falls back to a dense state preparation
+    assert qunits.set_superposition_gate(values, size) is None